@@ -0,0 +1,368 @@
+import json
+import os
+import re
+from datetime import date
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from app.core.helper import (
+    parse_date_column,
+    quarter_index,
+    QUARTER_CURRENT,
+    QUARTER_TOO_OLD,
+    QUARTER_FUTURE,
+)
+
+# Cell values that count as missing besides real nulls (after str() + strip)
+EMPTY_MARKERS = frozenset(["", "nan", "None", "(empty)", "(null)"])
+
+# Number of row numbers spelled out in an issue description
+ISSUE_PREVIEW_ROWS = 10
+
+# Issues with more offending rows than this are reported in compact form
+# (row ranges + a short preview); the full rows are paged from
+# /validation-issues. Callers can pass a lower limit (0 = always compact).
+VALIDATION_INLINE_ROW_LIMIT = int(os.getenv("VALIDATION_INLINE_ROW_LIMIT", "1000"))
+
+EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+URL_RE = re.compile(
+    r"(?:https?://)?(?:[\w-]+\.)+[a-z]{2,}(?::\d+)?(?:[/?#]\S*)?", re.IGNORECASE
+)
+PHONE_RE = re.compile(r"\+?[\d\s().\-/]{5,}")
+INTEGER_RE = re.compile(r"[+-]?\d+(?:\.0*)?")
+BOOLEAN_VALUES = frozenset(
+    ["true", "false", "yes", "no", "y", "n", "t", "f", "1", "0", "1.0", "0.0"]
+)
+
+
+# Run `check` once per distinct value and broadcast the result to every row
+def _per_unique(values: pd.Series, check: Callable[[pd.Series], np.ndarray]) -> np.ndarray:
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return np.asarray(check(pd.Series(uniques, dtype=object)), dtype=bool)[codes]
+
+
+def _stripped(uniques: pd.Series) -> pd.Series:
+    return uniques.astype(str).str.strip()
+
+
+# Sorted, inclusive [first, last] spreadsheet row ranges of the set rows in `mask`
+def row_ranges(mask: np.ndarray) -> List[List[int]]:
+    padded = np.concatenate(([False], np.asarray(mask, dtype=bool), [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    starts, ends = edges[0::2], edges[1::2] - 1
+    return np.column_stack((starts + 2, ends + 2)).tolist()
+
+
+# Row positions (0-based, header excluded) for entries offset..offset+limit of
+# the rows covered by `ranges`, without expanding the ranges that are skipped
+def page_row_positions(ranges: Sequence[Sequence[int]], offset: int, limit: int) -> np.ndarray:
+    if not ranges or limit <= 0:
+        return np.empty(0, dtype=np.int64)
+    bounds = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+    lengths = bounds[:, 1] - bounds[:, 0] + 1
+    ends = np.cumsum(lengths)
+    picks = np.arange(offset, min(offset + limit, int(ends[-1])), dtype=np.int64)
+    which = np.searchsorted(ends, picks, side="right")
+    starts = ends - lengths
+    return bounds[which, 0] + (picks - starts[which]) - 2
+
+
+# Key of an issue's mask in the per-session issue mask artifact
+def issue_mask_key(header_value: str, issue_type: str) -> str:
+    return f"{header_value}:{issue_type}"
+
+
+# Per-row issue masks packed to bits (1 bit per row) for storing with the session
+def pack_issue_masks(masks: Dict[str, np.ndarray], total_rows: int) -> dict:
+    return {
+        "total_rows": total_rows,
+        "masks": {key: np.packbits(mask) for key, mask in masks.items()},
+    }
+
+
+# Spreadsheet row numbers of an issue from the packed issue masks, or None if
+# the issue has no stored mask
+def issue_mask_rows(
+    issue_masks: Optional[dict], header_value: str, issue_type: str
+) -> Optional[List[int]]:
+    packed = (issue_masks or {}).get("masks", {}).get(issue_mask_key(header_value, issue_type))
+    if packed is None:
+        return None
+    return (np.flatnonzero(np.unpackbits(packed, count=issue_masks["total_rows"])) + 2).tolist()
+
+
+# (row positions for entries offset..offset+limit, total rows) of a packed mask
+def page_mask_positions(
+    packed: np.ndarray, total_rows: int, offset: int, limit: int
+) -> Tuple[np.ndarray, int]:
+    positions = np.flatnonzero(np.unpackbits(packed, count=total_rows))
+    return positions[offset : offset + max(limit, 0)], len(positions)
+
+
+def _is_compact(count: int, inline_limit: Optional[int]) -> bool:
+    limit = VALIDATION_INLINE_ROW_LIMIT if inline_limit is None else inline_limit
+    return count > limit
+
+
+# `row_ranges` and `row_range_count` of an issue. Compact issues only carry the
+# first ISSUE_PREVIEW_ROWS ranges; their full rows live in the issue masks.
+def _issue_ranges(mask: np.ndarray, compact: bool) -> dict:
+    ranges = row_ranges(mask)
+    return {
+        "row_ranges": ranges[:ISSUE_PREVIEW_ROWS] if compact else ranges,
+        "row_range_count": len(ranges),
+    }
+
+
+# Rows that are null or hold one of the EMPTY_MARKERS placeholders
+def missing_value_mask(series: pd.Series) -> np.ndarray:
+    null_mask = series.isna().to_numpy()
+    if not (pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)):
+        # str() of a number, bool or timestamp can never be an empty marker
+        return null_mask
+    return null_mask | _per_unique(series, lambda u: _stripped(u).isin(EMPTY_MARKERS).to_numpy())
+
+
+def _numeric(uniques: pd.Series) -> pd.Series:
+    return pd.to_numeric(_stripped(uniques), errors="coerce")
+
+
+def _valid_integer(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return np.zeros(len(series), dtype=bool)
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return np.ones(len(series), dtype=bool)
+    if pd.api.types.is_float_dtype(series.dtype):
+        values = series.to_numpy(dtype=float)
+        return np.isfinite(values) & (values == np.floor(values))
+    return _per_unique(series, lambda u: _stripped(u).str.fullmatch(INTEGER_RE).to_numpy())
+
+
+def _valid_float(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return np.zeros(len(series), dtype=bool)
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return np.isfinite(series.to_numpy(dtype=float))
+    return _per_unique(series, lambda u: np.isfinite(_numeric(u).to_numpy(dtype=float)))
+
+
+def _valid_date(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return np.ones(len(series), dtype=bool)
+    return ~np.isnat(parse_date_column(series))
+
+
+def _valid_boolean(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return np.ones(len(series), dtype=bool)
+    return _per_unique(series, lambda u: _stripped(u).str.lower().isin(BOOLEAN_VALUES).to_numpy())
+
+
+def _regex_validator(pattern: re.Pattern) -> Callable[[pd.Series], np.ndarray]:
+    def validate(series: pd.Series) -> np.ndarray:
+        return _per_unique(series, lambda u: _stripped(u).str.fullmatch(pattern).to_numpy())
+
+    return validate
+
+
+def _is_json(value) -> bool:
+    try:
+        json.loads(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _valid_json(series: pd.Series) -> np.ndarray:
+    return _per_unique(series, lambda u: np.array([_is_json(v) for v in _stripped(u)], dtype=bool))
+
+
+# expected type -> function returning a per-row "value is valid" mask.
+# Types without an entry (string, text) accept any value.
+TYPE_VALIDATORS: Dict[str, Callable[[pd.Series], np.ndarray]] = {
+    "integer": _valid_integer,
+    "float": _valid_float,
+    "date": _valid_date,
+    "boolean": _valid_boolean,
+    "email": _regex_validator(EMAIL_RE),
+    "url": _regex_validator(URL_RE),
+    "phone": _regex_validator(PHONE_RE),
+    "json": _valid_json,
+}
+
+
+# Rows holding a value that does not match `expected_type`; rows flagged in
+# `missing` are reported as missing data instead and never as invalid
+def invalid_type_mask(series: pd.Series, expected_type: str, missing: np.ndarray) -> np.ndarray:
+    validator = TYPE_VALIDATORS.get(expected_type)
+    if validator is None or missing.all():
+        return np.zeros(len(series), dtype=bool)
+    present = ~missing
+    invalid = np.zeros(len(series), dtype=bool)
+    invalid[present] = ~validator(series[present])
+    return invalid
+
+
+# MISSING_DATA issue for a column, or None if nothing is missing.
+# Row numbers are spreadsheet rows (header is row 1).
+# In compact form (more rows than `inline_limit`) the row lists and
+# `row_ranges` are cut down to a preview.
+def missing_data_issue(
+    header_value: str,
+    header_label: str,
+    data_type: str,
+    missing: np.ndarray,
+    inline_limit: Optional[int] = None,
+) -> Optional[dict]:
+    total_empty = int(missing.sum())
+    if total_empty == 0:
+        return None
+
+    compact = _is_compact(total_empty, inline_limit)
+    missing_positions = np.flatnonzero(missing)
+    if compact:
+        missing_positions = missing_positions[:ISSUE_PREVIEW_ROWS]
+    missing_rows_display = (missing_positions + 2).astype(str).tolist()
+    issue_description = f"Column '{header_label}' has {total_empty} missing values"
+    if total_empty > ISSUE_PREVIEW_ROWS:
+        issue_description += f" (showing first 10 rows: {','.join(missing_rows_display[:ISSUE_PREVIEW_ROWS])}...)"
+    else:
+        issue_description += f" in rows: {', '.join(missing_rows_display)}"
+
+    return {
+        "header_value": header_value,
+        "header_label": header_label,
+        "original_column": header_value,
+        "issue_type": "MISSING_DATA",
+        "issue_description": issue_description,
+        "column_name": header_label,
+        "data_type": data_type,
+        "total_missing": total_empty,
+        "percentage": round((total_empty / len(missing)) * 100, 2),
+        "missing_rows": missing_rows_display,
+        "has_more_rows": total_empty > ISSUE_PREVIEW_ROWS,
+        **_issue_ranges(missing, compact),
+        "compact": compact,
+    }
+
+
+# INVALID_TYPE issue for a column, or None if every present value is valid
+def invalid_type_issue(
+    header_value: str,
+    header_label: str,
+    expected_type: str,
+    invalid: np.ndarray,
+    inline_limit: Optional[int] = None,
+) -> Optional[dict]:
+    invalid_count = int(invalid.sum())
+    if invalid_count == 0:
+        return None
+
+    compact = _is_compact(invalid_count, inline_limit)
+    invalid_rows = (np.flatnonzero(invalid)[:ISSUE_PREVIEW_ROWS] + 2).tolist()
+    return {
+        "header_value": header_value,
+        "header_label": header_label,
+        "original_column": header_value,
+        "issue_type": "INVALID_TYPE",
+        "issue_description": f"Invalid {expected_type} values in rows: {', '.join(map(str, invalid_rows))}",
+        "expected_type": expected_type,
+        "invalid_rows": invalid_rows,
+        "invalid_count": invalid_count,
+        "total_rows": len(invalid),
+        "percentage": round((invalid_count / len(invalid)) * 100, 2),
+        "has_more_rows": invalid_count > ISSUE_PREVIEW_ROWS,
+        **_issue_ranges(invalid, compact),
+        "compact": compact,
+    }
+
+
+# Order dates outside the previous quarter. The column is parsed once and
+# classified with quarter-index arithmetic; only offending rows are turned
+# into {"row", "value", "issue"} dicts. Null and blank cells are skipped.
+# `positions` restricts the check to those rows (0-based, e.g. one page of a
+# compact issue); row numbers always refer to the whole file.
+def find_invalid_quarter_rows(
+    series: pd.Series, today: date, positions: Optional[np.ndarray] = None
+) -> List[dict]:
+    if positions is None:
+        positions = np.arange(len(series))
+    series = series.iloc[positions]
+    present = ~series.isna().to_numpy()
+    if pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype):
+        present &= ~_per_unique(series, lambda u: _stripped(u).eq("").to_numpy())
+    checked = np.flatnonzero(present)
+    if len(checked) == 0:
+        return []
+
+    parsed = pd.DatetimeIndex(parse_date_column(series.iloc[checked]))
+    unparseable = np.asarray(parsed.isna())
+    file_q_index = quarter_index(parsed.year.to_numpy(), parsed.month.to_numpy())
+    system_q_index = quarter_index(today.year, today.month)
+
+    issues = np.select(
+        [
+            unparseable,
+            file_q_index == system_q_index - 1,
+            file_q_index == system_q_index,
+            file_q_index < system_q_index - 1,
+        ],
+        ["", "", QUARTER_CURRENT, QUARTER_TOO_OLD],
+        default=QUARTER_FUTURE,
+    )
+    rejected = unparseable | (issues != "")
+
+    # Only the rejected cells are pulled back out as Python objects
+    values = series.iloc[checked[rejected]].tolist()
+    invalid_rows = []
+    for pos, value, issue, bad_format in zip(
+        np.asarray(positions)[checked[rejected]], values, issues[rejected], unparseable[rejected]
+    ):
+        invalid_rows.append(
+            {
+                "row": int(pos) + 2,
+                "value": str(value),
+                "issue": f"Invalid date format: {value}" if bad_format else str(issue),
+            }
+        )
+    return invalid_rows
+
+
+# Mask of the rows listed in find_invalid_quarter_rows output
+def quarter_rows_mask(invalid_rows: List[dict], total_rows: int) -> np.ndarray:
+    invalid = np.zeros(total_rows, dtype=bool)
+    invalid[[row["row"] - 2 for row in invalid_rows]] = True
+    return invalid
+
+
+# INVALID_QUARTER issue for the order date column, or None if every date is
+# accepted. `checked_on` is kept so the rows can be re-derived later.
+def invalid_quarter_issue(
+    header_label: str,
+    invalid_rows: List[dict],
+    invalid: np.ndarray,
+    checked_on: date,
+    inline_limit: Optional[int] = None,
+) -> Optional[dict]:
+    invalid_count = len(invalid_rows)
+    if invalid_count == 0:
+        return None
+
+    compact = _is_compact(invalid_count, inline_limit)
+    total_rows = len(invalid)
+    return {
+        "header_value": "order_date",
+        "header_label": header_label,
+        "original_column": "order_date",
+        "issue_type": "INVALID_QUARTER",
+        "issue_description": "Some order dates are not in the allowed previous quarter",
+        # All invalid rows, unless the issue is compact
+        "invalid_rows": invalid_rows[:ISSUE_PREVIEW_ROWS] if compact else invalid_rows,
+        "invalid_count": invalid_count,
+        "total_rows": total_rows,
+        "percentage": round((invalid_count / total_rows) * 100, 2),
+        "has_more_rows": compact,
+        **_issue_ranges(invalid, compact),
+        "compact": compact,
+        "checked_on": checked_on.isoformat(),
+    }
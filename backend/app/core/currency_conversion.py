@@ -1,51 +1,209 @@
+import asyncio
+import os
+import threading
+import time
 from collections import defaultdict
-from pymongo import DESCENDING
-from datetime import datetime, timedelta
+from datetime import datetime
+from typing import Optional, Tuple
+import numpy as np
 from app.core.database import db
+from app.core.logger import get_logger
+from app.core.metrics import cache_lookup, mongo_roundtrip
 
-async def get_ecb_fx_rates_from_db() -> dict[str, dict[str, float]]:
-    historical_rates = defaultdict(dict)
-    cursor = db["currency_update"].find().sort("date", DESCENDING)
+logger = get_logger("reference")
 
-    async for doc in cursor:
-        date = doc.get("date")
-        currency = doc.get("currency_code")
-        value = doc.get("value")
-        if date and currency and value:
-            historical_rates[date][currency.upper()] = value
-            historical_rates[date]["EUR"] = 1.0
+# Rates before this date are never used (same cut-off as the ECB backfill)
+ECB_HISTORY_START = np.datetime64("2023-01-01", "D")
 
-    return historical_rates
+# How often a worker picks up rates inserted by another process
+FX_INDEX_REFRESH_SECONDS = int(os.getenv("FX_INDEX_REFRESH_SECONDS", "3600"))
 
 
+class FxRateIndex:
+    """
+    Process-wide index of ECB rates: one sorted date array and one rate array
+    per currency. Answers "latest rate on or before date D" with a binary
+    search, either for a single row or for a whole column at once.
+    """
 
+    def __init__(self):
+        self._dates: dict[str, np.ndarray] = {}
+        self._rates: dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.last_date: Optional[str] = None
+        self.refreshed_at: Optional[float] = None
+        self.version = 0
+        # Shared currency_update reference version the index is known to cover
+        self.reference_version = 0
 
+    def add_rates(self, docs) -> int:
+        """Merge currency_update documents into the index, later docs win on duplicates."""
+        grouped = defaultdict(lambda: ([], []))
+        last_date = self.last_date
+        for doc in docs:
+            date_str = doc.get("date")
+            currency = doc.get("currency_code")
+            value = doc.get("value")
+            if date_str and currency and value:
+                dates, rates = grouped[currency.upper()]
+                dates.append(date_str)
+                rates.append(float(value))
+                if last_date is None or date_str > last_date:
+                    last_date = date_str
 
-def get_fx_rate_by_date_from_db_rates(rates_dict: dict[str, dict[str, float]], order_date: str, currency: str) -> float:
+        with self._lock:
+            for currency, (dates, rates) in grouped.items():
+                new_dates = np.array(dates, dtype="datetime64[D]")
+                new_rates = np.array(rates, dtype=float)
+                if currency in self._dates:
+                    new_dates = np.concatenate([self._dates[currency], new_dates])
+                    new_rates = np.concatenate([self._rates[currency], new_rates])
 
-    currency = currency.upper()
-    if currency == "EUR":
+                order = np.argsort(new_dates, kind="stable")
+                new_dates, new_rates = new_dates[order], new_rates[order]
+                # Keep the last value seen for a repeated date
+                keep = np.append(new_dates[1:] != new_dates[:-1], True)
+                self._dates[currency] = new_dates[keep]
+                self._rates[currency] = new_rates[keep]
+
+            self.last_date = last_date
+            self.refreshed_at = time.monotonic()
+            if grouped:
+                self.version += 1
+
+        return sum(len(dates) for dates, _ in grouped.values())
+
+    def replace_rates(self, docs) -> int:
+        """Rebuild the index from scratch; readers keep the old arrays until the swap."""
+        fresh = FxRateIndex()
+        added = fresh.add_rates(docs)
+        with self._lock:
+            self._dates, self._rates = fresh._dates, fresh._rates
+            self.last_date = fresh.last_date
+            self.refreshed_at = time.monotonic()
+            self.version += 1
+        return added
+
+    @staticmethod
+    def ecb_business_days(dates: np.ndarray) -> np.ndarray:
+        """Move Saturday/Sunday dates back to the preceding Friday."""
+        dates = dates.astype("datetime64[D]")
+        weekday = (dates.astype("int64") + 3) % 7  # Monday=0 ... Sunday=6
+        shift = np.where(weekday == 5, 1, np.where(weekday == 6, 2, 0))
+        return dates - shift.astype("timedelta64[D]")
+
+    def rate_on_or_before(self, currency: str, on_date) -> Optional[float]:
+        """ECB rate for one currency on or before `on_date`, None if unknown."""
+        currency = currency.upper()
+        if currency == "EUR":
+            return 1.0
+        dates = self._dates.get(currency)
+        if dates is None:
+            return None
+
+        target = self.ecb_business_days(np.array([on_date], dtype="datetime64[D]"))[0]
+        if target < ECB_HISTORY_START:
+            return None
+        pos = int(np.searchsorted(dates, target, side="right")) - 1
+        if pos < 0 or dates[pos] < ECB_HISTORY_START:
+            return None
+        return float(self._rates[currency][pos])
+
+    def rates_on_or_before(self, currencies: np.ndarray, dates: np.ndarray) -> np.ndarray:
+        """
+        Vectorized rate_on_or_before for whole columns. Returns NaN where no
+        rate exists (unknown currency, NaT date or date before ECB history).
+        """
+        currencies = np.asarray(currencies, dtype=object)
+        targets = self.ecb_business_days(np.asarray(dates, dtype="datetime64[D]"))
+        result = np.full(len(currencies), np.nan)
+        result[currencies == "EUR"] = 1.0
+
+        valid_dates = ~np.isnat(targets) & (targets >= ECB_HISTORY_START)
+        for currency in np.unique(currencies[valid_dates & (currencies != "EUR")]):
+            known_dates = self._dates.get(currency)
+            if known_dates is None:
+                continue
+            mask = valid_dates & (currencies == currency)
+            positions = np.searchsorted(known_dates, targets[mask], side="right") - 1
+            hit = positions >= 0
+            hit[hit] = known_dates[positions[hit]] >= ECB_HISTORY_START
+            rates = np.full(len(positions), np.nan)
+            rates[hit] = self._rates[currency][positions[hit]]
+            result[mask] = rates
+
+        return result
+
+    def get_fx_rate(self, order_date: str, currency: str) -> float:
+        """Rate for one order, falling back to 1.0 when no rate is known."""
+        try:
+            target_date = datetime.strptime(order_date, "%Y-%m-%d").date()
+            rate = self.rate_on_or_before(currency, target_date)
+            if rate is not None:
+                return rate
+        except Exception as e:
+            logger.warning("Error fetching FX rate: %s", e)
         return 1.0
-    
-    try:
-        target_date = datetime.strptime(order_date, "%Y-%m-%d")
-
-        # ECB weekend adjustment
-        weekday = target_date.isoweekday()  # Monday=1, Sunday=7
-        if weekday == 7:  # Sunday
-            target_date -= timedelta(days=2)
-        elif weekday == 6:  # Saturday
-            target_date -= timedelta(days=1)
-
-        # ECB holiday adjustment - go backward until a rate exists
-        while target_date >= datetime(2023, 1, 1):
-            date_str = target_date.strftime("%Y-%m-%d")
-            if date_str in rates_dict and currency in rates_dict[date_str]:
-                return rates_dict[date_str][currency]
-            target_date -= timedelta(days=1)  # move back 1 day
-
-    except Exception as e:
-        print(f"Error fetching FX rate: {e}")
-
-    # Fallback if no rate found
-    return 1.0
+
+
+fx_index = FxRateIndex()
+_fx_index_lock = asyncio.Lock()
+
+_RATE_PROJECTION = {"_id": 0, "date": 1, "currency_code": 1, "value": 1}
+
+
+# Load rates newer than what the index already holds, or with full=True
+# reload every rate. Inserts may backfill dates older than the index's
+# latest one, which the incremental query would never see, so whoever
+# inserts rates (and bumps the currency_update version) rebuilds in full.
+async def refresh_fx_index(full: bool = False, reference_version: Optional[int] = None) -> int:
+    async with _fx_index_lock:
+        return await _refresh_fx_index_locked(full, reference_version)
+
+
+# refresh_fx_index with _fx_index_lock held. `reference_version` is the
+# currency_update version the loaded rates cover; it is recorded together
+# with the rebuild so no later request rebuilds for the same version again.
+async def _refresh_fx_index_locked(full: bool, reference_version: Optional[int]) -> int:
+    full = full or fx_index.last_date is None
+    query = {} if full else {"date": {"$gte": fx_index.last_date}}
+    mongo_roundtrip("currency_update.find")
+    docs = await db["currency_update"].find(query, _RATE_PROJECTION).to_list(length=None)
+    if full:
+        added = fx_index.replace_rates(docs)
+    else:
+        added = fx_index.add_rates(docs)
+        fx_index.refreshed_at = time.monotonic()
+    if reference_version is not None:
+        fx_index.reference_version = max(fx_index.reference_version, reference_version)
+    logger.info(
+        "FX index %s with %d rates (latest date: %s)",
+        "rebuilt" if full else "refreshed", added, fx_index.last_date,
+    )
+    return added
+
+
+# (outdated, stale) of the shared index for the given currency_update version
+def _fx_index_state(reference_version: Optional[int]) -> Tuple[bool, bool]:
+    outdated = reference_version is not None and reference_version > fx_index.reference_version
+    stale = (
+        outdated
+        or fx_index.refreshed_at is None
+        or time.monotonic() - fx_index.refreshed_at > FX_INDEX_REFRESH_SECONDS
+    )
+    return outdated, stale
+
+
+# Shared FX index; only touches Mongo on first use, after the refresh interval
+# (newer dates only) or when another worker has inserted rates since
+# (reference_version is newer, full rebuild)
+async def get_fx_index(reference_version: Optional[int] = None) -> FxRateIndex:
+    outdated, stale = _fx_index_state(reference_version)
+    cache_lookup("fx_index", not stale)
+    if stale:
+        async with _fx_index_lock:
+            # Concurrent requests queue on the lock; only the first one refreshes
+            outdated, stale = _fx_index_state(reference_version)
+            if stale:
+                await _refresh_fx_index_locked(outdated, reference_version)
+    return fx_index
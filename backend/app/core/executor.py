@@ -0,0 +1,172 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+from fastapi import HTTPException
+from app.core.logger import get_logger
+from app.core.metrics import (
+    EXECUTOR_RUN_SECONDS,
+    EXECUTOR_WAIT_SECONDS,
+    apply_observations,
+    collect_observations,
+)
+from app.core.profiler import current_profile, profile_call
+
+logger = get_logger("executor")
+
+# Thread pool for work that mostly waits or releases the GIL (file parsing,
+# numpy/pandas column operations)
+EXECUTOR_THREAD_WORKERS = int(os.getenv("EXECUTOR_THREAD_WORKERS", "4"))
+# Process pool for pure-Python, GIL-bound work (openpyxl, reportlab, zip).
+# 0 runs those stages on the thread pool instead.
+EXECUTOR_PROCESS_WORKERS = int(os.getenv("EXECUTOR_PROCESS_WORKERS", "2"))
+# Jobs admitted at once (running + waiting for a stage slot); beyond this
+# requests are rejected with 503 instead of piling up
+EXECUTOR_MAX_PENDING = int(os.getenv("EXECUTOR_MAX_PENDING", "32"))
+
+# stage -> (pool, default concurrency); override with EXECUTOR_<STAGE>_CONCURRENCY
+STAGES = {
+    "parse": ("thread", 4),  # reading uploaded CSV/Excel files
+    "validate": ("thread", 3),  # per-column checks and session store reads/writes
+    "enrich": ("thread", 2),  # VAT enrichment column math
+    "report": ("process", 2),  # Excel/PDF/ZIP generation
+}
+
+
+class ExecutorBusyError(HTTPException):
+    def __init__(self, stage: str):
+        super().__init__(
+            status_code=503,
+            detail=f"Server is busy ({stage}), please try again shortly",
+            headers={"Retry-After": "5"},
+        )
+
+
+class StageExecutor:
+    """
+    Runs blocking stages of request handling off the event loop.
+
+    Each stage is bound to the thread or process pool and has its own
+    concurrency limit, so e.g. a burst of report downloads cannot take every
+    thread away from file parsing. A single counter bounds the jobs admitted
+    across all stages; when it is full new jobs fail fast with a 503.
+    Pools are created on first use.
+    """
+
+    def __init__(self, thread_workers: int, process_workers: int, max_pending: int):
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self.max_pending = max_pending
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.limits = {
+            stage: int(os.getenv(f"EXECUTOR_{stage.upper()}_CONCURRENCY", str(default)))
+            for stage, (_, default) in STAGES.items()
+        }
+        self.pending = 0
+        self.running = {stage: 0 for stage in STAGES}
+        self.completed = {stage: 0 for stage in STAGES}
+        self.rejected = 0
+
+    def _pool(self, stage: str) -> Executor:
+        kind = STAGES[stage][0]
+        if kind == "process" and self.process_workers > 0:
+            if self._process_pool is None:
+                # spawn: forking a process that runs an event loop and threads is unsafe
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._process_pool
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self.thread_workers, thread_name_prefix="qhuube-worker"
+            )
+        return self._thread_pool
+
+    def _semaphore(self, stage: str) -> asyncio.Semaphore:
+        if stage not in self._semaphores:
+            self._semaphores[stage] = asyncio.Semaphore(self.limits[stage])
+        return self._semaphores[stage]
+
+    async def run(self, stage: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        if stage not in STAGES:
+            raise ValueError(f"Unknown executor stage '{stage}'")
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning("Executor queue full (%d jobs), rejecting %s job", self.pending, stage)
+            raise ExecutorBusyError(stage)
+
+        self.pending += 1
+        queued_at = time.perf_counter()
+        try:
+            async with self._semaphore(stage):
+                started_at = time.perf_counter()
+                EXECUTOR_WAIT_SECONDS.observe(started_at - queued_at, stage=stage)
+                self.running[stage] += 1
+                try:
+                    loop = asyncio.get_running_loop()
+                    # Metrics recorded by fn come back with its result, so
+                    # timings taken in a worker process are not lost
+                    call = functools.partial(collect_observations, fn, *args, **kwargs)
+                    # A profiled request profiles its jobs in the worker too
+                    profile = current_profile.get()
+                    if profile is not None:
+                        call = functools.partial(profile_call, call)
+                    try:
+                        result = await loop.run_in_executor(self._pool(stage), call)
+                        if profile is not None:
+                            result, worker_stats = result
+                            profile.add_worker_stats(worker_stats)
+                        result, observations = result
+                        apply_observations(observations)
+                        return result
+                    except BrokenProcessPool:
+                        # A crashed worker breaks the whole pool; start a new one next time
+                        self._process_pool = None
+                        raise
+                finally:
+                    EXECUTOR_RUN_SECONDS.observe(time.perf_counter() - started_at, stage=stage)
+                    self.running[stage] -= 1
+                    self.completed[stage] += 1
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "stages": {
+                stage: {
+                    "pool": STAGES[stage][0] if self.process_workers > 0 else "thread",
+                    "limit": self.limits[stage],
+                    "running": self.running[stage],
+                    "completed": self.completed[stage],
+                }
+                for stage in STAGES
+            },
+        }
+
+    def shutdown(self) -> None:
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+executor = StageExecutor(
+    thread_workers=EXECUTOR_THREAD_WORKERS,
+    process_workers=EXECUTOR_PROCESS_WORKERS,
+    max_pending=EXECUTOR_MAX_PENDING,
+)
+
+
+# Run a blocking function in the pool of the given stage
+async def run_in_stage(stage: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    return await executor.run(stage, fn, *args, **kwargs)
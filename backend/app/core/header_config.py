@@ -0,0 +1,108 @@
+import asyncio
+import os
+import time
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+from app.core.helper import TYPE_MAP
+from app.models.header_model import get_all_headers
+from app.models.reference_version_model import get_reference_versions, HEADERS
+from app.core.logger import get_logger
+from app.core.metrics import cache_lookup
+
+logger = get_logger("reference")
+
+# How often a worker picks up header edits made through another process;
+# edits made through this process apply immediately
+HEADER_CONFIG_REFRESH_SECONDS = int(os.getenv("HEADER_CONFIG_REFRESH_SECONDS", "60"))
+
+
+class HeaderConfig(NamedTuple):
+    """
+    The configured headers indexed for validation and reporting. Read-only:
+    copy the mappings (dict(...)) before storing them in a session or
+    sending them to another process.
+    """
+
+    version: int  # "headers" reference version the config was loaded at
+    alias_to_value: Mapping[str, str]  # lowercased alias -> header value
+    required_headers: Tuple[str, ...]
+    header_labels: Mapping[str, str]  # header value -> label
+    expected_types: Mapping[str, str]  # header value -> TYPE_MAP type
+    validation_types: Mapping[str, str]  # as expected_types, "phone" kept apart
+    aliases: frozenset  # every lowercased alias, for column projection
+
+    @classmethod
+    def from_headers(cls, all_headers: list, version: int = 0) -> "HeaderConfig":
+        alias_to_value = {}
+        required_headers = []
+        header_labels = {}
+        expected_types = {}
+        validation_types = {}
+        for header in all_headers:
+            value = header["value"]
+            required_headers.append(value)
+            header_labels[value] = header["label"]
+
+            for alias in header["aliases"]:
+                alias_to_value[alias.strip().lower()] = value
+
+            raw_type = header.get("type", "string")
+            mapped_type = TYPE_MAP.get(raw_type.lower(), "string")
+            expected_types[value] = mapped_type
+            # Phone numbers are reported as integers but may contain +, spaces, dashes
+            validation_types[value] = "phone" if raw_type.lower() == "phone" else mapped_type
+        return cls(
+            version=version,
+            alias_to_value=MappingProxyType(alias_to_value),
+            required_headers=tuple(required_headers),
+            header_labels=MappingProxyType(header_labels),
+            expected_types=MappingProxyType(expected_types),
+            validation_types=MappingProxyType(validation_types),
+            aliases=frozenset(alias_to_value),
+        )
+
+
+_header_config: Optional[HeaderConfig] = None
+_loaded_at: Optional[float] = None
+# Bumped on every invalidation so a reload that raced an edit is not cached
+_generation = 0
+_header_config_lock = asyncio.Lock()
+
+
+# Drop the cached config; the next get_header_config() reloads it
+def invalidate_header_config() -> None:
+    global _header_config, _generation
+    _header_config = None
+    _generation += 1
+
+
+# Shared header config; only touches Mongo on first use, after a local header
+# edit, after the refresh interval or when the caller already knows of a newer
+# "headers" reference version
+async def get_header_config(reference_version: Optional[int] = None) -> HeaderConfig:
+    global _header_config, _loaded_at
+    config = _header_config
+    if (
+        config is not None
+        and time.monotonic() - _loaded_at <= HEADER_CONFIG_REFRESH_SECONDS
+        and (reference_version is None or reference_version <= config.version)
+    ):
+        cache_lookup("header_config", True)
+        return config
+    cache_lookup("header_config", False)
+
+    async with _header_config_lock:
+        # Another request may have reloaded it while we waited
+        config = _header_config
+        if (
+            config is None
+            or time.monotonic() - _loaded_at > HEADER_CONFIG_REFRESH_SECONDS
+            or (reference_version is not None and reference_version > config.version)
+        ):
+            generation = _generation
+            version = (await get_reference_versions())[HEADERS]
+            config = HeaderConfig.from_headers(await get_all_headers(), version)
+            if generation == _generation:
+                _header_config, _loaded_at = config, time.monotonic()
+            logger.info("Header config loaded: %d headers (version %d)", len(config.required_headers), version)
+        return config
@@ -1,13 +1,14 @@
 from typing import Dict, List
-import io, pandas as pd
+import pandas as pd
 import numpy as np
-from app.models.header_model import get_all_headers
 from datetime import date
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 import unicodedata
+from functools import lru_cache
+import warnings
+from app.core.logger import get_logger
+from app.core.metrics import timed
+
+logger = get_logger("helper")
 
 # Map frontend types to internal Python-friendly types
 TYPE_MAP = {
@@ -33,7 +34,7 @@ def get_user_friendly_dtype(dtype):
         return 'Number (Integer)'
     elif 'float' in dtype_str:
         return 'Number (Decimal)'
-    elif 'object' in dtype_str:
+    elif 'object' in dtype_str or 'string' in dtype_str:
         return 'Text'
     elif 'datetime' in dtype_str:
         return 'Date/Time'
@@ -63,6 +64,74 @@ def safe_round(value, decimals=2):
     except (ValueError, TypeError):
         return 0.0
 
+# Column version of safe_float: nulls become the default, anything
+# pandas cannot parse falls back to safe_float for that value only
+def safe_float_column(series: pd.Series, default=0.0) -> np.ndarray:
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        values = series.astype(float).to_numpy(copy=True)
+        values[np.isnan(values)] = default
+        return values
+
+    numeric = pd.to_numeric(series, errors="coerce").astype(float)
+    null_mask = series.isna()
+    leftovers = numeric.isna() & ~null_mask
+    if leftovers.any():
+        numeric[leftovers] = series[leftovers].map(lambda v: safe_float(v, default))
+    numeric[null_mask] = default
+    return numeric.to_numpy()
+
+# Column version of safe_round; NaN/inf become 0.0 and halfway cases
+# are re-rounded with round() so results match safe_round exactly
+def safe_round_array(values, decimals=2) -> np.ndarray:
+    values = np.asarray(values, dtype=float)
+    values = np.where(np.isfinite(values), values, 0.0)
+    rounded = np.round(values, decimals)
+    scaled = values * (10 ** decimals)
+    ties = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    if ties.any():
+        rounded[ties] = [round(v, decimals) for v in values[ties].tolist()]
+    return rounded
+
+# Parse a list of distinct date values; anything unparseable becomes NaT
+def _parse_distinct_dates(values: list) -> pd.DatetimeIndex:
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)
+            parsed = pd.to_datetime(pd.Index(values, dtype=object), errors="coerce", format="mixed")
+        if isinstance(parsed, pd.DatetimeIndex):
+            return parsed.tz_localize(None) if parsed.tz is not None else parsed
+    except (ValueError, TypeError):
+        pass
+
+    # Mixed timezones and similar oddities: fall back to one value at a time
+    parsed_values = []
+    for value in values:
+        try:
+            parsed_value = pd.to_datetime(value)
+            if parsed_value is not pd.NaT and parsed_value.tzinfo is not None:
+                parsed_value = parsed_value.tz_localize(None)
+            parsed_values.append(parsed_value)
+        except (ValueError, TypeError, OverflowError):
+            parsed_values.append(pd.NaT)
+    return pd.DatetimeIndex(parsed_values)
+
+# Parse a date column once per distinct value instead of once per row.
+# Returns datetime64 values aligned with the input; invalid entries are NaT.
+@timed("parse_dates")
+def parse_date_column(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        if getattr(series.dt, "tz", None) is not None:
+            series = series.dt.tz_localize(None)
+        return series.to_numpy(dtype="datetime64[ns]")
+
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    uniques = [value.strip() if isinstance(value, str) else value for value in uniques]
+    parsed = _parse_distinct_dates(uniques).to_numpy(dtype="datetime64[ns]")
+    result = np.full(len(series), np.datetime64("NaT"), dtype="datetime64[ns]")
+    valid = codes >= 0
+    result[valid] = parsed[codes[valid]]
+    return result
+
 # Check if a value is numeric and potentially problematic for JSON
 def is_problematic_numeric(value):
     try:
@@ -77,6 +146,7 @@ def is_problematic_numeric(value):
 
 
 # Convert DataFrame to JSON-safe format
+@timed("dataframe_to_json")
 def dataframe_to_json_safe(df):
     try:
         # Create a copy to avoid modifying original
@@ -137,7 +207,7 @@ def dataframe_to_json_safe(df):
         return clean_records
         
     except Exception as e:
-        print(f"Error in dataframe_to_json_safe: {str(e)}")
+        logger.warning("Error in dataframe_to_json_safe: %s", e)
         # Fallback: return empty list if conversion fails completely
         return []
 
@@ -162,24 +232,28 @@ def generate_manual_review_summary(manual_rows: List[Dict]) -> str:
 
     return "\n".join(summary_lines)
 
-async def rename_columns_with_labels(df: pd.DataFrame) -> pd.DataFrame:
-    all_headers = await get_all_headers()
-    
-    header_labels = {header['value']: header['label'] for header in all_headers}
 
+# Rename columns from header values to labels ({value: label}), no DB access
+def apply_header_labels(df: pd.DataFrame, header_labels: Dict[str, str]) -> pd.DataFrame:
     rename_map = {}
     for col in df.columns:
         if col in header_labels:
             rename_map[col] = header_labels[col]
-            print(f"Will rename column '{col}' to '{header_labels[col]}'")
+            logger.debug("Will rename column %r to %r", col, header_labels[col])
 
     if rename_map:
         df = df.rename(columns=rename_map)
     else:
-        print("No columns found that match header values for renaming")
+        logger.debug("No columns found that match header values for renaming")
 
     return df
 
+QUARTER_ACCEPTED = "Accepted: Order date is valid for the previous quarter."
+QUARTER_CURRENT = "Rejected: Order date is in the current quarter, not allowed."
+QUARTER_TOO_OLD = "Rejected: Order date is too old, must be within the last quarter."
+QUARTER_FUTURE = "Rejected: Order date is in the future, not allowed."
+
+
 def get_quarter(date: date) -> str:
     month = date.month
     if month <= 3:
@@ -192,145 +266,26 @@ def get_quarter(date: date) -> str:
         return "Q4"
     
 
-def validate_order_date(order_date: date, current_date: date) -> str:
-    file_quarter = get_quarter(order_date)
-    system_quarter = get_quarter(current_date)
+# Consecutive quarter number (year * 4 + quarter); works on scalars and numpy arrays
+def quarter_index(year, month):
+    return year * 4 + (month - 1) // 3 + 1
 
-    file_q_index = order_date.year * 4 + int(file_quarter[1])
-    system_q_index = current_date.year * 4 + int(system_quarter[1])
+
+def validate_order_date(order_date: date, current_date: date) -> str:
+    file_q_index = quarter_index(order_date.year, order_date.month)
+    system_q_index = quarter_index(current_date.year, current_date.month)
 
     if file_q_index == system_q_index - 1:
-        return "Accepted: Order date is valid for the previous quarter."
+        return QUARTER_ACCEPTED
     elif file_q_index == system_q_index:
-        return "Rejected: Order date is in the current quarter, not allowed."
+        return QUARTER_CURRENT
     elif file_q_index < system_q_index - 1:
-        return "Rejected: Order date is too old, must be within the last quarter."
+        return QUARTER_TOO_OLD
     else:
-        return "Rejected: Order date is in the future, not allowed."
+        return QUARTER_FUTURE
 
-def dataframe_to_pdf(df: pd.DataFrame, pdf_stream: io.BytesIO, title: str):
-    """
-    Generate a professional, print-ready VAT Report PDF (A4 landscape)
-    with all data right-aligned and headers centered.
-    Ensures words are not split mid-word in headers (e.g., 'Country' won't become 'Coun\ntry').
-    """
-
-    # --- Setup document ---
-    doc = SimpleDocTemplate(
-        pdf_stream,
-        pagesize=landscape(A4),
-        leftMargin=30,
-        rightMargin=30,
-        topMargin=30,
-        bottomMargin=30,
-    )
-
-    styles = getSampleStyleSheet()
-
-    # --- Title style ---
-    title_style = ParagraphStyle(
-        "TitleStyle",
-        parent=styles["Title"],
-        fontName="Helvetica-Bold",
-        fontSize=14,
-        alignment=1,  # Center
-        spaceAfter=12,
-    )
-
-    # --- Header style (centered, no breaking inside single words) ---
-    header_style = ParagraphStyle(
-        "HeaderStyle",
-        fontName="Helvetica-Bold",
-        fontSize=8,
-        alignment=1,  # Center
-        leading=10,
-        wordWrap="None",  # allow wrap only between words
-    )
-
-    # --- Cell style (right aligned) ---
-    cell_style = ParagraphStyle(
-        "CellStyle",
-        fontName="Helvetica",
-        fontSize=7,
-        alignment=2,  # Right align
-        leading=9,
-        wordWrap="None",
-    )
-
-    # --- Build title ---
-    elements = [Paragraph(title, title_style), Spacer(1, 8)]
-
-    # --- Prepare Data ---
-    df = df.fillna("")
-
-    # Create header row (no splitting inside single words)
-    header_row = [
-        Paragraph(" ".join(col.split()), header_style)
-        for col in df.columns
-    ]
-
-    # Create data rows
-    data_rows = [
-        [Paragraph(str(cell), cell_style) for cell in row]
-        for row in df.astype(str).values.tolist()
-    ]
-
-    data = [header_row] + data_rows
-
-    # --- Calculate proportional column widths ---
-    page_width, _ = landscape(A4)
-    usable_width = page_width - doc.leftMargin - doc.rightMargin
-
-    avg_lengths = [
-        max(len(str(col)), int(df[col].astype(str).str.len().mean() or 5))
-        for col in df.columns
-    ]
-    total_len = sum(avg_lengths)
-    col_widths = [usable_width * (l / total_len) for l in avg_lengths]
-
-    # Limit column sizes (ensure no narrow columns that force word breaks)
-    min_w, max_w = 70, 120
-    col_widths = [max(min_w, min(w, max_w)) for w in col_widths]
-
-    if "Order Date" in df.columns:
-        idx = list(df.columns).index("Order Date")
-        col_widths[idx] = max(col_widths[idx], 80)
-
-    # Normalize to fit exactly within usable width
-    scale = usable_width / sum(col_widths)
-    col_widths = [w * scale for w in col_widths]
-
-    # --- Build Table ---
-    table = Table(data, colWidths=col_widths, repeatRows=1)
-
-    table.setStyle(TableStyle([
-        # Header formatting
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("FONTSIZE", (0, 0), (-1, 0), 9),
-        ("ALIGN", (0, 0), (-1, 0), "CENTER"),
-        ("VALIGN", (0, 0), (-1, 0), "MIDDLE"),
-        ("BOTTOMPADDING", (0, 0), (-1, 0), 8),
-        ("TOPPADDING", (0, 0), (-1, 0), 6),
-        ("LINEBELOW", (0, 0), (-1, 0), 0.6, colors.black),
-
-        # Data cells formatting
-        ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
-        ("FONTSIZE", (0, 1), (-1, -1), 8),
-        ("ALIGN", (0, 1), (-1, -1), "RIGHT"),
-        ("VALIGN", (0, 1), (-1, -1), "MIDDLE"),
-        ("TOPPADDING", (0, 1), (-1, -1), 3.5),
-        ("BOTTOMPADDING", (0, 1), (-1, -1), 3.5),
-
-        # Grid lines
-        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
-    ]))
-
-    elements.append(table)
-
-    # --- Build PDF ---
-    doc.build(elements)
-    pdf_stream.seek(0)
-    return pdf_stream.getvalue()
+# Distinct strings whose normalized form is kept across requests
+NORMALIZE_CACHE_SIZE = 65536
 
 
 def normalize_string(value: str) -> str:
@@ -343,11 +298,19 @@ def normalize_string(value: str) -> str:
     """
     if not isinstance(value, str):
         return ""
-    
-    # Replace all Unicode whitespace with regular spaces, then strip
-    value = ''.join(c if not c.isspace() else ' ' for c in value)
-    value = ' '.join(value.split())  # Normalize multiple spaces to single space
-    
+    return _normalize_text(value)
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_text(value: str) -> str:
+    # Normalize runs of Unicode whitespace to single spaces (str.split()
+    # splits on exactly the characters str.isspace() reports)
+    value = ' '.join(value.split())
+
+    # Plain ASCII has no accents to strip
+    if value.isascii():
+        return value.lower()
+
     # Convert to NFD (decomposed) form and remove combining marks (accents)
     value = unicodedata.normalize('NFD', value)
     value = ''.join(c for c in value if unicodedata.category(c) != 'Mn')
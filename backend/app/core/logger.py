@@ -0,0 +1,57 @@
+import logging
+import os
+from typing import Optional
+import pandas as pd
+
+# Level for the app's loggers; DEBUG also turns on the sampled frame dumps
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Rows (or list items) shown by a debug dump
+LOG_SAMPLE_ROWS = int(os.getenv("LOG_SAMPLE_ROWS", "20"))
+
+ROOT_LOGGER = "qhuube"
+
+_root = logging.getLogger(ROOT_LOGGER)
+if not _root.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _root.addHandler(_handler)
+    _root.setLevel(LOG_LEVEL)
+    # uvicorn may configure the root logger too; don't print everything twice
+    _root.propagate = False
+
+
+# Logger for one part of the app, e.g. get_logger("validation") -> "qhuube.validation"
+def get_logger(subsystem: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{subsystem}")
+
+
+class _FrameSample:
+    """Renders a few evenly spaced rows of a frame, only when it is logged."""
+
+    def __init__(self, df: pd.DataFrame, rows: int):
+        self.df = df
+        self.rows = rows
+
+    def __str__(self) -> str:
+        total = len(self.df)
+        if total > self.rows:
+            step = total / self.rows
+            sample = self.df.iloc[[int(i * step) for i in range(self.rows)]]
+        else:
+            sample = self.df
+        with pd.option_context("display.max_columns", None, "display.width", None):
+            return f"({len(sample)} of {total} rows)\n{sample.to_string()}"
+
+
+# Debug dump of a DataFrame, sampled to LOG_SAMPLE_ROWS rows. Nothing is
+# formatted unless DEBUG is enabled for `logger`.
+def debug_frame(logger: logging.Logger, title: str, df: pd.DataFrame, rows: Optional[int] = None) -> None:
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s %s", title, _FrameSample(df, rows or LOG_SAMPLE_ROWS))
+
+
+# Debug dump of the first LOG_SAMPLE_ROWS items of a list
+def debug_items(logger: logging.Logger, title: str, items: list, rows: Optional[int] = None) -> None:
+    if logger.isEnabledFor(logging.DEBUG):
+        rows = rows or LOG_SAMPLE_ROWS
+        logger.debug("%s (%d of %d): %s", title, min(rows, len(items)), len(items), items[:rows])
@@ -0,0 +1,520 @@
+import functools
+import inspect
+import os
+import pickle
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from app.core.logger import get_logger
+
+logger = get_logger("metrics")
+
+# Every worker process writes its metrics here and /metrics merges all of
+# them, so a scrape sees the whole server whichever worker answers it
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "qhuube_metrics"))
+# How often a worker writes its snapshot to METRICS_DIR
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+# Files of stopped workers older than this are folded into a running
+# worker's snapshot and deleted, so METRICS_DIR does not grow with restarts
+METRICS_FOLD_AFTER_SECONDS = 10 * METRICS_FLUSH_SECONDS
+
+# Histogram buckets (seconds) for stage timings
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Upper bounds (bytes) of the file size label on per-file timings
+SIZE_BUCKETS = ((1 << 20, "lt_1mb"), (10 << 20, "1mb_10mb"), (100 << 20, "10mb_100mb"))
+SIZE_BUCKET_MAX = "ge_100mb"
+
+
+def size_bucket(size_bytes: Optional[int]) -> str:
+    if size_bytes is None:
+        return "unknown"
+    for limit, label in SIZE_BUCKETS:
+        if size_bytes < limit:
+            return label
+    return SIZE_BUCKET_MAX
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        _record(("counter", self.name, tuple(labels[n] for n in self.labelnames), amount))
+
+    def _apply(self, key: Tuple[str, ...], amount: float) -> None:
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(snapshots: List[Dict[Tuple[str, ...], float]]) -> Dict[Tuple[str, ...], float]:
+        merged: Dict[Tuple[str, ...], float] = {}
+        for values in snapshots:
+            for key, value in values.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self, values: Dict[Tuple[str, ...], float]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DURATION_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> (per-bucket counts with a final +Inf slot, sum)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        _record(("histogram", self.name, tuple(labels[n] for n in self.labelnames), value))
+
+    def _apply(self, key: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Tuple[List[int], float]]:
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+    @staticmethod
+    def merge(
+        snapshots: List[Dict[Tuple[str, ...], Tuple[List[int], float]]]
+    ) -> Dict[Tuple[str, ...], Tuple[List[int], float]]:
+        merged: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+        for values in snapshots:
+            for key, (counts, total) in values.items():
+                if key in merged:
+                    merged_counts, merged_total = merged[key]
+                    merged[key] = ([a + b for a, b in zip(merged_counts, counts)], merged_total + total)
+                else:
+                    merged[key] = (list(counts), total)
+        return merged
+
+    def render(self, values: Dict[Tuple[str, ...], Tuple[List[int], float]]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total:g}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "qhuube_stage_duration_seconds", "Time spent in one pipeline stage", ("stage",)
+)
+FILE_SECONDS = Histogram(
+    "qhuube_file_duration_seconds",
+    "End-to-end time per file and pipeline, by file size",
+    ("pipeline", "size_bucket"),
+)
+EXECUTOR_WAIT_SECONDS = Histogram(
+    "qhuube_executor_wait_seconds", "Time a job waited for a worker slot", ("stage",)
+)
+EXECUTOR_RUN_SECONDS = Histogram(
+    "qhuube_executor_run_seconds", "Time a job ran on its worker pool", ("stage",)
+)
+ROWS_PROCESSED = Counter("qhuube_rows_processed_total", "Rows processed per stage", ("stage",))
+BYTES = Counter(
+    "qhuube_bytes_total", "Bytes received (in) and produced (out)", ("direction", "kind")
+)
+CACHE_LOOKUPS = Counter(
+    "qhuube_cache_lookups_total", "Cache lookups by cache and result", ("cache", "result")
+)
+MONGO_ROUNDTRIPS = Counter(
+    "qhuube_mongo_roundtrips_total", "MongoDB queries issued", ("operation",)
+)
+
+_METRICS = {
+    metric.name: metric
+    for metric in (
+        STAGE_SECONDS,
+        FILE_SECONDS,
+        EXECUTOR_WAIT_SECONDS,
+        EXECUTOR_RUN_SECONDS,
+        ROWS_PROCESSED,
+        BYTES,
+        CACHE_LOOKUPS,
+        MONGO_ROUNDTRIPS,
+    )
+}
+
+# Set inside collect_observations(): observations go to this list instead of
+# the registry, so a process-pool worker can hand them back with its result
+_buffer = threading.local()
+
+
+def _record(observation: tuple) -> None:
+    pending = getattr(_buffer, "observations", None)
+    if pending is not None:
+        pending.append(observation)
+    else:
+        apply_observations([observation])
+
+
+def apply_observations(observations: List[tuple]) -> None:
+    for _, name, key, value in observations:
+        _METRICS[name]._apply(key, value)
+
+
+# Run fn and return (result, observations it recorded); used by the executor
+# so timings taken in a worker process reach this process's registry
+def collect_observations(fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, List[tuple]]:
+    previous = getattr(_buffer, "observations", None)
+    _buffer.observations = []
+    try:
+        result = fn(*args, **kwargs)
+        return result, _buffer.observations
+    finally:
+        _buffer.observations = previous
+
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def mongo_roundtrip(operation: str) -> None:
+    MONGO_ROUNDTRIPS.inc(operation=operation)
+
+
+class timed:
+    """
+    Time a pipeline stage into qhuube_stage_duration_seconds, either as
+    `with timed("parse"):` or as `@timed("parse")` on a sync or async function.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.observe(time.perf_counter() - self._start, stage=self.stage)
+        return False
+
+    def __call__(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        stage = self.stage
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with timed(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+# Time one file through a pipeline ("validate", "enrich", "report"),
+# labelled with its size bucket
+def observe_file(pipeline: str, size_bytes: Optional[int], started: float) -> None:
+    FILE_SECONDS.observe(
+        time.perf_counter() - started, pipeline=pipeline, size_bucket=size_bucket(size_bytes)
+    )
+
+
+@contextmanager
+def timed_file(pipeline: str, size_bytes: Optional[int]) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_file(pipeline, size_bytes, started)
+
+
+# Point-in-time stats of this worker, e.g. StageExecutor.stats() and
+# SessionBackend.stats(), written with its snapshot and rendered per worker
+_stats_sources: Dict[str, Callable[[], dict]] = {}
+
+
+def register_stats(name: str, source: Callable[[], dict]) -> None:
+    _stats_sources[name] = source
+
+
+# This worker's snapshot file; the start time keeps a reused pid from
+# overwriting the totals of a dead worker
+_worker_file = os.path.join(METRICS_DIR, f"worker-{os.getpid()}-{int(time.time() * 1000)}.pkl")
+_writer_stop = threading.Event()
+_writer: Optional[threading.Thread] = None
+
+# Totals taken over from stopped workers' files, and the files folded in
+# since the last flush (listed in the snapshot so readers skip them until
+# they are deleted)
+_folded_values: Dict[str, Any] = {}
+_folded_files: List[str] = []
+_fold_lock = threading.Lock()
+
+
+def _snapshot() -> dict:
+    with _fold_lock:
+        metrics = {
+            name: metric.merge([metric.snapshot(), _folded_values.get(name, {})])
+            for name, metric in _METRICS.items()
+        }
+        folded = [_base_name(path) for path in _folded_files]
+    return {
+        "worker": str(os.getpid()),
+        "written_at": time.time(),
+        "metrics": metrics,
+        "stats": {name: source() for name, source in _stats_sources.items()},
+        "folded": folded,
+    }
+
+
+# Snapshot file name without the ".folded-by-<pid>" suffix of a claimed file
+def _base_name(path: str) -> str:
+    return os.path.basename(path).split(".folded-by-")[0]
+
+
+# Pid of the process that owns a snapshot file: its worker, or the worker
+# folding it. None if the name is not a snapshot file.
+def _file_owner(name: str) -> Optional[int]:
+    if not name.startswith("worker-"):
+        return None
+    try:
+        if ".folded-by-" in name:
+            return int(name.rsplit("-", 1)[1])
+        return int(name.split("-")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_running(pid: int) -> bool:
+    if os.name != "posix":
+        # No cheap liveness check; never fold
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Take over the totals of workers that stopped. A file is claimed by renaming
+# it, so only one worker folds it; a claim left by a worker that stopped while
+# folding is picked up again later.
+def _fold_stopped_workers() -> None:
+    fold_before = time.time() - METRICS_FOLD_AFTER_SECONDS
+    claimed: Dict[str, Optional[dict]] = {}
+    for entry in os.scandir(METRICS_DIR):
+        owner = _file_owner(entry.name)
+        if owner is None or entry.path == _worker_file:
+            continue
+        try:
+            if entry.stat().st_mtime >= fold_before or _pid_running(owner):
+                continue
+            path = os.path.join(METRICS_DIR, f"{_base_name(entry.name)}.folded-by-{os.getpid()}")
+            os.rename(entry.path, path)
+        except OSError:
+            # Already claimed by another worker
+            continue
+        try:
+            with open(path, "rb") as f:
+                claimed[path] = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning("Dropping unreadable metrics snapshot %s: %s", entry.name, e)
+            claimed[path] = None
+    if not claimed:
+        return
+
+    # A stopped folder's snapshot already holds the files it was folding
+    included = {name for snapshot in claimed.values() if snapshot for name in snapshot.get("folded", ())}
+    with _fold_lock:
+        for path, snapshot in claimed.items():
+            if snapshot is not None and _base_name(path) not in included:
+                for name, metric in _METRICS.items():
+                    _folded_values[name] = metric.merge(
+                        [_folded_values.get(name, {}), snapshot["metrics"].get(name, {})]
+                    )
+            _folded_files.append(path)
+    logger.info("Folded metrics of %d stopped workers", len(claimed))
+
+
+# Write this worker's snapshot to METRICS_DIR (atomically, readers never see
+# a partial file), folding in the files of stopped workers first
+def flush_metrics() -> None:
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _fold_stopped_workers()
+    fd, tmp_path = tempfile.mkstemp(prefix=".worker-", dir=METRICS_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(_snapshot(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, _worker_file)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    # The snapshot just written holds their totals
+    with _fold_lock:
+        for path in _folded_files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        _folded_files.clear()
+
+
+def _write_periodically() -> None:
+    while not _writer_stop.wait(METRICS_FLUSH_SECONDS):
+        try:
+            flush_metrics()
+        except Exception as e:
+            logger.warning("Could not write metrics snapshot: %s", e)
+
+
+# Called on app startup/shutdown: write the snapshot every
+# METRICS_FLUSH_SECONDS, and a last time when the worker stops
+def start_metrics_writer() -> None:
+    global _writer
+    if _writer is None:
+        _writer_stop.clear()
+        _writer = threading.Thread(target=_write_periodically, name="qhuube-metrics", daemon=True)
+        _writer.start()
+
+
+def stop_metrics_writer() -> None:
+    global _writer
+    if _writer is not None:
+        _writer_stop.set()
+        _writer.join()
+        _writer = None
+        flush_metrics()
+
+
+# This worker's live snapshot plus the last one written by every other
+# worker. Stopped workers count until their totals are folded into a running
+# worker's snapshot; files a snapshot lists as folded are skipped, so merged
+# totals never go down or count twice.
+def _load_snapshots() -> List[dict]:
+    snapshots = {_base_name(_worker_file): _snapshot()}
+    if os.path.isdir(METRICS_DIR):
+        for entry in os.scandir(METRICS_DIR):
+            if _file_owner(entry.name) is None or entry.path == _worker_file:
+                continue
+            try:
+                with open(entry.path, "rb") as f:
+                    snapshots[_base_name(entry.name)] = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError) as e:
+                logger.warning("Skipping unreadable metrics snapshot %s: %s", entry.name, e)
+    folded = {name for snapshot in snapshots.values() for name in snapshot.get("folded", ())}
+    return [snapshot for name, snapshot in snapshots.items() if name not in folded]
+
+
+def _samples(name: str, kind: str, documentation: str, samples: List[Tuple[str, float]]) -> List[str]:
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{labels} {value:g}" for labels, value in samples)
+    return lines
+
+
+def _render_executor(workers: List[Tuple[str, dict]]) -> List[str]:
+    pending, max_pending, rejected = [], [], []
+    running, limit, completed = [], [], []
+    for worker, stats in workers:
+        labels = _format_labels(("worker",), (worker,))
+        pending.append((labels, stats["pending"]))
+        max_pending.append((labels, stats["max_pending"]))
+        rejected.append((labels, stats["rejected"]))
+        for stage, values in stats["stages"].items():
+            stage_labels = _format_labels(("worker", "stage"), (worker, stage))
+            running.append((stage_labels, values["running"]))
+            limit.append((stage_labels, values["limit"]))
+            completed.append((stage_labels, values["completed"]))
+    return (
+        _samples("qhuube_executor_pending_jobs", "gauge", "Jobs admitted and not finished", pending)
+        + _samples("qhuube_executor_max_pending_jobs", "gauge", "Admission limit", max_pending)
+        + _samples("qhuube_executor_running_jobs", "gauge", "Jobs running per stage", running)
+        + _samples("qhuube_executor_stage_limit", "gauge", "Concurrency limit per stage", limit)
+        + _samples("qhuube_executor_completed_jobs_total", "counter", "Jobs finished per stage", completed)
+        + _samples("qhuube_executor_rejected_jobs_total", "counter", "Jobs rejected with 503", rejected)
+    )
+
+
+def _render_sessions(workers: List[Tuple[str, dict]]) -> List[str]:
+    series = {
+        "sessions": ("qhuube_sessions", "gauge", "Sessions held"),
+        "bytes_held": ("qhuube_session_bytes_held", "gauge", "Session bytes kept in memory"),
+        "bytes_on_disk": ("qhuube_session_bytes_on_disk", "gauge", "Session bytes on disk"),
+    }
+    for key in ("hits", "misses", "expired_evictions", "memory_evictions", "disk_evictions"):
+        series[key] = (f"qhuube_session_{key}_total", "counter", f"Session store {key.replace('_', ' ')}")
+
+    lines: List[str] = []
+    for key, (name, kind, documentation) in series.items():
+        samples = [
+            (_format_labels(("worker", "backend"), (worker, stats["backend"])), stats[key])
+            for worker, stats in workers
+            if key in stats
+        ]
+        if samples:
+            lines += _samples(name, kind, documentation, samples)
+    return lines
+
+
+# Everything in Prometheus text format. Counters and histograms are summed
+# over all workers; executor and session store stats (from register_stats)
+# are labelled by worker and only shown for workers that are still running.
+def render_metrics() -> str:
+    snapshots = _load_snapshots()
+    lines: List[str] = []
+    for name, metric in _METRICS.items():
+        values = metric.merge([snapshot["metrics"].get(name, {}) for snapshot in snapshots])
+        lines.extend(metric.render(values))
+
+    # A running worker rewrites its file every METRICS_FLUSH_SECONDS
+    live_after = time.time() - 3 * METRICS_FLUSH_SECONDS
+    live = [snapshot for snapshot in snapshots if snapshot["written_at"] >= live_after]
+    for name, render in (("executor", _render_executor), ("sessions", _render_sessions)):
+        workers = [(s["worker"], s["stats"][name]) for s in live if name in s["stats"]]
+        if workers:
+            lines += render(workers)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,75 @@
+import contextvars
+import cProfile
+import pstats
+from typing import Any, Callable, List, Optional
+
+# Profiling primitives shared by the event loop and the executor workers.
+# Worker processes import this module to run profile_call, so it must not
+# import anything with import-time side effects (session store, database).
+
+
+class _RawStats:
+    """pstats.Stats accepts any object with create_stats() and .stats."""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class RequestProfile:
+    """
+    cProfile data for one request: the handler on the event loop plus every
+    executor job it ran, each profiled in its own worker thread or process.
+    The event loop part also sees other requests' coroutines that ran in
+    between.
+    """
+
+    def __init__(self):
+        self._profiler: Optional[cProfile.Profile] = cProfile.Profile()
+        self._worker_stats: List[dict] = []
+
+    def start(self) -> None:
+        try:
+            self._profiler.enable()
+        except ValueError:
+            # Another profiler is active (e.g. a concurrent profiled request
+            # on Python 3.12+); keep the worker profiles only
+            self._profiler = None
+
+    def stop(self) -> None:
+        if self._profiler is not None:
+            self._profiler.disable()
+
+    def add_worker_stats(self, stats: Optional[dict]) -> None:
+        if stats:
+            self._worker_stats.append(stats)
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self._profiler) if self._profiler is not None else pstats.Stats()
+        for worker_stats in self._worker_stats:
+            stats.add(_RawStats(worker_stats))
+        return stats
+
+
+# Profile of the request being handled, seen by the executor
+current_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+# Run fn under its own profiler (in a worker) and return (result, raw stats);
+# the caller adds the stats to its RequestProfile
+def profile_call(fn: Callable[..., Any], *args, **kwargs):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return fn(*args, **kwargs), None
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+    profiler.create_stats()
+    return result, profiler.stats
@@ -0,0 +1,114 @@
+import functools
+import inspect
+import io
+import marshal
+from datetime import datetime
+from typing import Any, List, Optional
+from fastapi import Depends, Header, HTTPException, Query
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from app.core.executor import run_in_stage
+from app.core.logger import get_logger
+from app.core.profiler import RequestProfile, current_profile
+from app.core.security import verify_access_token
+from app.core.session_store import get_session_store
+
+logger = get_logger("profiling")
+
+PROFILE_ARTIFACT = "profile"
+# Functions listed in the text report, by cumulative time
+PROFILE_TEXT_LINES = 80
+
+_optional_bearer = HTTPBearer(auto_error=False)
+
+
+# Profiling is opt-in per request with ?profile=true or "X-Profile: true",
+# and only for admins. Returns False straight away when neither is set.
+async def profile_requested(
+    profile: bool = Query(False),
+    x_profile: Optional[str] = Header(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_optional_bearer),
+) -> bool:
+    if not profile and (x_profile or "").strip().lower() not in ("1", "true", "yes"):
+        return False
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Profiling requires an admin token")
+    verify_access_token(credentials)
+    return True
+
+
+def _profile_artifact(profile: RequestProfile, endpoint: str) -> dict:
+    stats = profile.stats()
+    text = io.StringIO()
+    stats.stream = text
+    stats.sort_stats("cumulative").print_stats(PROFILE_TEXT_LINES)
+    return {
+        "endpoint": endpoint,
+        "created_at": datetime.now().isoformat(),
+        "text": text.getvalue(),
+        # Same format as cProfile's dump_stats, for snakeviz and friends
+        "pstats": marshal.dumps(stats.stats),
+    }
+
+
+# Formats the profile and writes it to the session store (blocking)
+def _store_profile(profile: RequestProfile, endpoint: str, session_ids: List[str]) -> None:
+    artifact = _profile_artifact(profile, endpoint)
+    for session_id in session_ids:
+        get_session_store().put_artifact(session_id, PROFILE_ARTIFACT, artifact)
+
+
+# Session ids a profiled request worked on: its session_id argument, or the
+# sessions created by /validate-file
+def _profiled_sessions(kwargs: dict, result: Any) -> List[str]:
+    if kwargs.get("session_id"):
+        return [kwargs["session_id"]]
+    if isinstance(result, dict):
+        return [f["session_id"] for f in result.get("files", []) if f.get("session_id")]
+    return []
+
+
+# Route decorator: adds the profile_requested dependency to the endpoint.
+# Unprofiled requests call the endpoint as is; profiled ones run under a
+# RequestProfile that is stored on the session(s) as PROFILE_ARTIFACT.
+def profileable(endpoint: str):
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, profiling: bool = False, **kwargs):
+            if not profiling:
+                return await fn(*args, **kwargs)
+
+            profile = RequestProfile()
+            token = current_profile.set(profile)
+            profile.start()
+            try:
+                result = await fn(*args, **kwargs)
+            finally:
+                profile.stop()
+                current_profile.reset(token)
+
+            session_ids = _profiled_sessions(kwargs, result)
+            if session_ids:
+                try:
+                    await run_in_stage("validate", _store_profile, profile, endpoint, session_ids)
+                except HTTPException:
+                    # Executor queue full: the request itself succeeded
+                    logger.warning("Dropped %s profile for sessions %s", endpoint, session_ids)
+                else:
+                    logger.info("Stored %s profile for sessions %s", endpoint, session_ids)
+            return result
+
+        wrapper.__signature__ = signature.replace(
+            parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter(
+                    "profiling",
+                    inspect.Parameter.KEYWORD_ONLY,
+                    default=Depends(profile_requested),
+                ),
+            ]
+        )
+        return wrapper
+
+    return decorator
@@ -0,0 +1,610 @@
+import hashlib
+import io
+import json
+import zipfile
+from typing import Dict, Optional
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import PatternFill, Font, Border, Side, Alignment
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.dataframe import dataframe_to_rows
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib import colors
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from app.core.column_validation import issue_mask_rows
+from app.core.logger import get_logger, debug_items
+from app.core.metrics import timed
+
+logger = get_logger("reports")
+
+# Bump whenever the layout of the generated Excel/PDF files changes, so
+# cached reports built with the old layout are not served again
+REPORT_TEMPLATE_VERSION = "1"
+
+REPORT_ARTIFACT = "vat_report"
+
+
+# Content hash identifying one generated report: the uploaded file, the
+# reference data it was enriched with, the report template and the file
+# names inside the ZIP. Also used as the ETag of the download.
+def report_cache_key(content_hash: str, reference_versions: Dict[str, int], base_name: str) -> str:
+    payload = json.dumps(
+        {
+            "content": content_hash,
+            "versions": reference_versions,
+            "template": REPORT_TEMPLATE_VERSION,
+            "base_name": base_name,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def dataframe_to_pdf(df: pd.DataFrame, pdf_stream: io.BytesIO, title: str):
+    """
+    Generate a professional, print-ready VAT Report PDF (A4 landscape)
+    with all data right-aligned and headers centered.
+    Ensures words are not split mid-word in headers (e.g., 'Country' won't become 'Coun\ntry').
+    """
+
+    # --- Setup document ---
+    doc = SimpleDocTemplate(
+        pdf_stream,
+        pagesize=landscape(A4),
+        leftMargin=30,
+        rightMargin=30,
+        topMargin=30,
+        bottomMargin=30,
+    )
+
+    styles = getSampleStyleSheet()
+
+    # --- Title style ---
+    title_style = ParagraphStyle(
+        "TitleStyle",
+        parent=styles["Title"],
+        fontName="Helvetica-Bold",
+        fontSize=14,
+        alignment=1,  # Center
+        spaceAfter=12,
+    )
+
+    # --- Header style (centered, no breaking inside single words) ---
+    header_style = ParagraphStyle(
+        "HeaderStyle",
+        fontName="Helvetica-Bold",
+        fontSize=8,
+        alignment=1,  # Center
+        leading=10,
+        wordWrap="None",  # allow wrap only between words
+    )
+
+    # --- Cell style (right aligned) ---
+    cell_style = ParagraphStyle(
+        "CellStyle",
+        fontName="Helvetica",
+        fontSize=7,
+        alignment=2,  # Right align
+        leading=9,
+        wordWrap="None",
+    )
+
+    # --- Build title ---
+    elements = [Paragraph(title, title_style), Spacer(1, 8)]
+
+    # --- Prepare Data ---
+    df = df.fillna("")
+
+    # Create header row (no splitting inside single words)
+    header_row = [
+        Paragraph(" ".join(col.split()), header_style)
+        for col in df.columns
+    ]
+
+    # Create data rows
+    data_rows = [
+        [Paragraph(str(cell), cell_style) for cell in row]
+        for row in df.astype(str).values.tolist()
+    ]
+
+    data = [header_row] + data_rows
+
+    # --- Calculate proportional column widths ---
+    page_width, _ = landscape(A4)
+    usable_width = page_width - doc.leftMargin - doc.rightMargin
+
+    avg_lengths = [
+        max(len(str(col)), int(df[col].astype(str).str.len().mean() or 5))
+        for col in df.columns
+    ]
+    total_len = sum(avg_lengths)
+    col_widths = [usable_width * (l / total_len) for l in avg_lengths]
+
+    # Limit column sizes (ensure no narrow columns that force word breaks)
+    min_w, max_w = 70, 120
+    col_widths = [max(min_w, min(w, max_w)) for w in col_widths]
+
+    if "Order Date" in df.columns:
+        idx = list(df.columns).index("Order Date")
+        col_widths[idx] = max(col_widths[idx], 80)
+
+    # Normalize to fit exactly within usable width
+    scale = usable_width / sum(col_widths)
+    col_widths = [w * scale for w in col_widths]
+
+    # --- Build Table ---
+    table = Table(data, colWidths=col_widths, repeatRows=1)
+
+    table.setStyle(TableStyle([
+        # Header formatting
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, 0), 9),
+        ("ALIGN", (0, 0), (-1, 0), "CENTER"),
+        ("VALIGN", (0, 0), (-1, 0), "MIDDLE"),
+        ("BOTTOMPADDING", (0, 0), (-1, 0), 8),
+        ("TOPPADDING", (0, 0), (-1, 0), 6),
+        ("LINEBELOW", (0, 0), (-1, 0), 0.6, colors.black),
+
+        # Data cells formatting
+        ("FONTNAME", (0, 1), (-1, -1), "Helvetica"),
+        ("FONTSIZE", (0, 1), (-1, -1), 8),
+        ("ALIGN", (0, 1), (-1, -1), "RIGHT"),
+        ("VALIGN", (0, 1), (-1, -1), "MIDDLE"),
+        ("TOPPADDING", (0, 1), (-1, -1), 3.5),
+        ("BOTTOMPADDING", (0, 1), (-1, -1), 3.5),
+
+        # Grid lines
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+    ]))
+
+    elements.append(table)
+
+    # --- Build PDF ---
+    doc.build(elements)
+    pdf_stream.seek(0)
+    return pdf_stream.getvalue()
+
+
+@timed("report_excel")
+def _vat_report_excel(enriched_df: pd.DataFrame, vat_summary: dict) -> bytes:
+    stream = io.BytesIO()
+    with pd.ExcelWriter(stream, engine="openpyxl") as writer:
+        enriched_df.to_excel(writer, index=False, sheet_name="VAT Report")
+        vat_sheet = writer.sheets["VAT Report"]
+
+        start_row = enriched_df.shape[0] + 3
+        vat_sheet.cell(row=start_row, column=5, value="Overall Net Total")
+        vat_sheet.cell(row=start_row + 1, column=5, value=vat_summary["overall_net_price"])
+        vat_sheet.cell(row=start_row, column=13, value="Overall VAT Amount")
+        vat_sheet.cell(row=start_row + 1, column=13, value=vat_summary["overall_vat_amount"])
+        vat_sheet.cell(row=start_row, column=14, value="Overall Gross Total")
+        vat_sheet.cell(row=start_row + 1, column=14, value=vat_summary["overall_gross_total"])
+
+        for row in vat_sheet.iter_rows():
+            for cell in row:
+                cell.font = Font(name="Calibri", size=12, bold=False)
+    return stream.getvalue()
+
+
+@timed("report_summary_excel")
+def _summary_excel(summary_df: pd.DataFrame) -> bytes:
+    stream = io.BytesIO()
+    with pd.ExcelWriter(stream, engine="openpyxl") as writer:
+        summary_df.to_excel(writer, index=False, sheet_name="Summary")
+        summary_sheet = writer.sheets["Summary"]
+        for row in summary_sheet.iter_rows():
+            for cell in row:
+                cell.font = Font(name="Calibri", size=12, bold=False)
+    return stream.getvalue()
+
+
+@timed("report_pdf")
+def _pdf(df: pd.DataFrame, title: str) -> bytes:
+    stream = io.BytesIO()
+    dataframe_to_pdf(df, stream, title)
+    return stream.getvalue()
+
+
+# Build the VAT and summary reports (Excel + PDF) from an enrichment result.
+# Plain synchronous code, so it can run outside the event loop.
+def build_vat_report_members(
+    enriched_df: pd.DataFrame, summary_df: pd.DataFrame, vat_summary: dict, base_name: str
+) -> Dict[str, bytes]:
+    for col in enriched_df.columns:
+        if "order date" in col.lower() and pd.api.types.is_datetime64_any_dtype(enriched_df[col]):
+            enriched_df[col] = enriched_df[col].dt.strftime("%d-%m-%Y")
+
+    return {
+        f"{base_name}_VAT_Report.xlsx": _vat_report_excel(enriched_df, vat_summary),
+        f"{base_name}_Summary.xlsx": _summary_excel(summary_df),
+        f"{base_name}_VAT_Report.pdf": _pdf(enriched_df, "VAT Report"),
+        f"{base_name}_Summary.pdf": _pdf(summary_df, "Summary Report"),
+    }
+
+
+@timed("report_zip")
+def bundle_zip(members: Dict[str, bytes]) -> bytes:
+    zip_stream = io.BytesIO()
+    with zipfile.ZipFile(zip_stream, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for name, content in members.items():
+            zipf.writestr(name, content)
+    return zip_stream.getvalue()
+
+
+# Members and finished ZIP in one call, so the whole build runs in one worker
+def build_vat_report_zip(
+    enriched_df: pd.DataFrame, summary_df: pd.DataFrame, vat_summary: dict, base_name: str
+) -> tuple[Dict[str, bytes], bytes]:
+    members = build_vat_report_members(enriched_df, summary_df, vat_summary, base_name)
+    return members, bundle_zip(members)
+
+
+# Every row number of an issue. Row lists and row ranges of compact issues are
+# cut down to a preview, so the stored issue masks are used when available.
+def _issue_row_numbers(issue: dict, rows_key: str, issue_masks: Optional[dict]) -> list:
+    rows = issue_mask_rows(issue_masks, issue.get("original_column"), issue["issue_type"])
+    if rows is not None:
+        return rows
+    if "row_ranges" in issue and not issue.get("compact"):
+        return [row for start, end in issue["row_ranges"] for row in range(start, end + 1)]
+    return issue.get(rows_key, [])
+
+
+# Annotated copy of the upload: missing/invalid cells highlighted on the data
+# sheet plus a "Validation Issues" sheet. `header_labels` maps header values
+# to their display labels; `issue_masks` is the session's packed issue mask
+# artifact, which holds the full rows of compact issues.
+@timed("issues_workbook")
+def build_issues_workbook(
+    df: pd.DataFrame,
+    validation_result: dict,
+    header_labels: Dict[str, str],
+    issue_masks: Optional[dict] = None,
+) -> bytes:
+    # Format date columns
+    for col in df.columns:
+        if "order date" in col.lower():
+            df[col] = pd.to_datetime(df[col], errors="coerce").dt.strftime(
+                "%d-%m-%Y"
+            )
+
+    reverse_rename_map = {}
+    for key, val in header_labels.items():
+        reverse_rename_map[key] = val
+
+    # Create rename mapping for existing columns
+    rename_map = {}
+    for col in df.columns:
+        # Check if this column has a corresponding label
+        if col in header_labels:
+            rename_map[col] = header_labels[col]
+
+    # Apply the renaming
+    if rename_map:
+        df.rename(columns=rename_map, inplace=True)
+
+    issues = validation_result.get("data_issues", [])
+    missing_headers = validation_result.get("missing_headers_detailed", [])
+    header_labels = validation_result.get("header_labels", {})
+
+    # Insert placeholder columns for missing headers
+    missing_labels = [mh["header_label"] for mh in missing_headers]
+    for label in missing_labels:
+        if label not in df.columns:
+            df[label] = ""
+
+    # Build issues sheet
+    issues_rows = []
+    for mh in missing_headers:
+        issues_rows.append(
+            {
+                "Issue Type": "Missing Header",
+                "Column": mh["header_label"],
+                "Description": mh["description"],
+            }
+        )
+
+    for issue in issues:
+        issues_rows.append(
+            {
+                "Issue Type": issue["issue_type"],
+                "Column": issue["header_label"],
+                "Description": issue["issue_description"],
+                "Missing Count": issue.get("total_missing")
+                or issue.get("invalid_count", ""),
+                "Missing %": issue.get("percentage", ""),
+            }
+        )
+
+    issues_df = pd.DataFrame(
+        issues_rows
+        or [
+            {
+                "Issue Type": "None",
+                "Column": "All",
+                "Description": "No missing headers or data issues found.",
+            }
+        ]
+    )
+
+    # --- Create Excel workbook ---
+    wb = Workbook()
+    ws_data = wb.active
+    ws_data.title = "User Data"
+
+    # Fills
+    red_fill = PatternFill(
+        start_color="FF9999", end_color="FF9999", fill_type="solid"
+    )  # Header or invalid type
+    orange_fill = PatternFill(
+        start_color="FFBF00", end_color="FFF2CC", fill_type="solid"
+    )  # Missing values
+    header_fill = PatternFill(
+        start_color="D9D9D9", end_color="D9D9D9", fill_type="solid"
+    )  # Normal header
+    bold_font = Font(bold=True)
+    thin_border = Border(
+        left=Side(style="thin"),
+        right=Side(style="thin"),
+        top=Side(style="thin"),
+        bottom=Side(style="thin"),
+    )
+
+    # --- Write data ---
+    for r in dataframe_to_rows(df, index=False, header=True):
+        ws_data.append(r)
+
+    col_name_to_index = {col: idx for idx, col in enumerate(df.columns)}
+
+    # --- Highlight headers ---
+    for col_idx, col in enumerate(df.columns, start=1):
+        cell = ws_data.cell(row=1, column=col_idx)
+        cell.font = bold_font
+        cell.border = thin_border
+        cell.alignment = Alignment(horizontal="center")
+        cell.fill = red_fill if col in missing_labels else header_fill
+
+    # --- Highlight issues ---
+    for issue in issues:
+        original_col = issue.get("original_column")
+        if not original_col:
+            continue
+
+        # Map system name to label
+        renamed_col = reverse_rename_map.get(original_col, original_col)
+        if renamed_col not in col_name_to_index:
+            continue
+
+        col_idx = col_name_to_index[renamed_col] + 1  # openpyxl is 1-indexed
+
+        if issue["issue_type"] == "MISSING_DATA":
+            for row_str in _issue_row_numbers(issue, "missing_rows", issue_masks):
+                try:
+                    row_num = int(row_str)
+                    ws_data.cell(row=row_num, column=col_idx).fill = orange_fill
+                except Exception:
+                    continue
+
+        elif issue["issue_type"] == "INVALID_TYPE":
+            for row_num in _issue_row_numbers(issue, "invalid_rows", issue_masks):
+                try:
+                    ws_data.cell(row=row_num, column=col_idx).fill = red_fill
+                except Exception:
+                    continue
+
+        elif issue["issue_type"] == "INVALID_QUARTER":
+            col_key = issue.get("header_label") or issue.get("original_column")
+            if col_key not in col_name_to_index:
+                continue
+            col_idx = col_name_to_index[col_key] + 1
+
+            for row_info in _issue_row_numbers(issue, "invalid_rows", issue_masks):
+                try:
+                    row_num = (
+                        row_info["row"]
+                        if isinstance(row_info, dict)
+                        else int(row_info)
+                    )
+                    ws_data.cell(row=row_num, column=col_idx).fill = red_fill
+                except Exception:
+                    continue
+
+    # --- Style data cells + autosize ---
+    for row in ws_data.iter_rows(min_row=2):
+        for cell in row:
+            cell.border = thin_border
+            cell.alignment = Alignment(vertical="center")
+
+    for col in ws_data.columns:
+        max_len = max(
+            (len(str(cell.value)) for cell in col if cell.value), default=10
+        )
+        col_letter = get_column_letter(col[0].column)
+        ws_data.column_dimensions[col_letter].width = max_len + 2
+
+    # --- Add issues sheet ---
+    ws_issues = wb.create_sheet("Validation Issues")
+    for r in dataframe_to_rows(issues_df, index=False, header=True):
+        ws_issues.append(r)
+
+    for col in ws_issues.iter_cols(min_row=1, max_row=1):
+        for cell in col:
+            cell.fill = header_fill
+            cell.font = bold_font
+            cell.border = thin_border
+
+    for row in ws_issues.iter_rows(min_row=2):
+        for cell in row:
+            cell.border = thin_border
+            cell.alignment = Alignment(wrap_text=True, vertical="top")
+
+    for col in ws_issues.columns:
+        max_len = max(
+            (len(str(cell.value)) for cell in col if cell.value), default=10
+        )
+        col_letter = get_column_letter(col[0].column)
+        ws_issues.column_dimensions[col_letter].width = max_len + 2
+
+    # --- Output stream ---
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+# VAT report (and summary, if any) for manual review, with rows that have a
+# "Not Found" value highlighted
+@timed("manual_review_workbook")
+def build_manual_review_workbook(df: pd.DataFrame, summary_df: Optional[pd.DataFrame]) -> bytes:
+    # ===== Build Excel with VAT Report & Summary =====
+    manual_email_stream = io.BytesIO()
+    with pd.ExcelWriter(manual_email_stream, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="VAT Report")
+        if summary_df is not None and not summary_df.empty:
+            summary_df.to_excel(writer, index=False, sheet_name="Summary")
+    manual_email_stream.seek(0)
+
+    # ===== Load workbook for highlighting =====
+    workbook = load_workbook(manual_email_stream)
+    fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+
+    for sheet_name in ["VAT Report", "Summary"]:
+        if sheet_name in workbook.sheetnames:
+            sheet = workbook[sheet_name]
+            for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row):
+                highlight_row = any(
+                    str(cell.value).strip() == "Not Found"
+                    for cell in row
+                    if cell.value is not None
+                )
+                for cell in row:
+                    cell.font = Font(name="Calibri", size=12, bold=False)
+                    if highlight_row:
+                        cell.fill = fill
+            for cell in sheet[1]:
+                cell.font = Font(name="Calibri", size=12, bold=False)
+
+    # ===== Save highlighted file to stream =====
+    final_manual_email_stream = io.BytesIO()
+    workbook.save(final_manual_email_stream)
+    return final_manual_email_stream.getvalue()
+
+
+# Upload with rows outside the accepted quarter highlighted, plus an
+# "Issue Details" sheet listing every invalid date
+@timed("quarter_issues_workbook")
+def build_quarter_issues_workbook(df_for_email: pd.DataFrame, quarter_issues: list) -> bytes:
+    excel_stream = io.BytesIO()
+    with pd.ExcelWriter(excel_stream, engine="openpyxl") as writer:
+        df_for_email.to_excel(writer, index=False, sheet_name="Quarter Issues")
+
+        # Get the workbook and worksheet for highlighting
+        workbook = writer.book
+        worksheet = writer.sheets["Quarter Issues"]
+
+        # Define highlighting styles
+        red_fill = PatternFill(
+            start_color="FFCCCC", end_color="FFCCCC", fill_type="solid"
+        )  # Light red background
+        red_font = Font(color="CC0000", bold=True)  # Dark red font
+
+        # Collect all invalid row numbers for highlighting
+        invalid_row_numbers = set()
+        if quarter_issues:
+            for issue in quarter_issues:
+                for row_info in issue["invalid_rows"]:
+                    if isinstance(row_info, dict):
+                        row_num = row_info.get("row")
+                        if row_num is not None:
+                            # Convert to Excel row number (row_num is already 1-based from validation)
+                            # Add 1 for the header row that pandas adds
+                            excel_row = int(row_num)
+                            invalid_row_numbers.add(excel_row)
+
+        # Add a legend/note at the top FIRST
+        if invalid_row_numbers:
+            # Insert a row at the top for the legend
+            worksheet.insert_rows(1)
+            legend_cell = worksheet.cell(row=1, column=1)
+            legend_cell.value = f"⚠️ HIGHLIGHTED ROWS ({len(invalid_row_numbers)} total) have Quarter Validation Issues - See 'Issue Details' sheet for specifics"
+            legend_cell.fill = PatternFill(
+                start_color="FFFFCC", end_color="FFFFCC", fill_type="solid"
+            )  # Light yellow
+            legend_cell.font = Font(bold=True, color="CC6600")
+
+            # Merge cells for the legend to span across columns
+            if worksheet.max_column > 1:
+                worksheet.merge_cells(
+                    start_row=1,
+                    start_column=1,
+                    end_row=1,
+                    end_column=worksheet.max_column,
+                )
+
+            # Now highlight invalid rows (add 1 more to account for the legend row we just inserted)
+            max_col = worksheet.max_column
+            for row_num in invalid_row_numbers:
+                # Add 1 for the legend row we inserted at the top
+                adjusted_row = row_num + 1
+                if adjusted_row <= worksheet.max_row:  # Ensure row exists
+                    for col in range(1, max_col + 1):
+                        cell = worksheet.cell(row=adjusted_row, column=col)
+                        cell.fill = red_fill
+                        cell.font = red_font
+
+            logger.debug("Highlighted %d quarter issue rows", len(invalid_row_numbers))
+            debug_items(logger, "Highlighted rows", sorted(invalid_row_numbers))
+
+        # Create issues summary sheet
+        if quarter_issues:
+            issues_data = []
+            for issue in quarter_issues:
+                for row_info in issue[
+                    "invalid_rows"
+                ]:  # Include all invalid rows in Excel
+                    if isinstance(row_info, dict):
+                        issues_data.append(
+                            {
+                                "Column": issue["column"],
+                                "Row Number": row_info.get("row", "N/A"),
+                                "Invalid Value": row_info.get("value", "N/A"),
+                                "Issue Description": row_info.get(
+                                    "issue", "Outside quarter range"
+                                ),
+                            }
+                        )
+
+            if issues_data:
+                issues_df = pd.DataFrame(issues_data)
+                issues_df.to_excel(writer, index=False, sheet_name="Issue Details")
+
+                # Format the Issue Details sheet
+                issues_worksheet = writer.sheets["Issue Details"]
+
+                # Style the header row
+                header_fill = PatternFill(
+                    start_color="4472C4", end_color="4472C4", fill_type="solid"
+                )  # Blue background
+                header_font = Font(color="FFFFFF", bold=True)  # White font
+
+                for col in range(1, len(issues_df.columns) + 1):
+                    cell = issues_worksheet.cell(row=1, column=col)
+                    cell.fill = header_fill
+                    cell.font = header_font
+
+                # Auto-adjust column widths
+                for column in issues_worksheet.columns:
+                    max_length = 0
+                    column_letter = column[0].column_letter
+                    for cell in column:
+                        try:
+                            if len(str(cell.value)) > max_length:
+                                max_length = len(str(cell.value))
+                        except:
+                            pass
+                    adjusted_width = min(max_length + 2, 50)  # Cap at 50 characters
+                    issues_worksheet.column_dimensions[column_letter].width = (
+                        adjusted_width
+                    )
+
+    return excel_stream.getvalue()
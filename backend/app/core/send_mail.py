@@ -8,6 +8,7 @@ import httpx
 from dotenv import load_dotenv
 
 from app.core.helper import generate_manual_review_summary
+from app.core.metrics import BYTES, timed
 
 load_dotenv()
 
@@ -15,6 +16,7 @@ load_dotenv()
 # ----------------------------------------------------------------------
 # Low-level Postmark sender
 # ----------------------------------------------------------------------
+@timed("email_send")
 async def send_email_via_postmark_api(
     to_email: str,
     subject: str,
@@ -87,6 +89,12 @@ async def send_email_via_postmark_api(
         }
 
         print(f"Postmark: to={to_email} stream={message_stream}")
+        # Attachment bytes as sent (base64)
+        BYTES.inc(
+            sum(len(a["Content"] or "") for a in data.get("Attachments", [])),
+            direction="out",
+            kind="email_attachments",
+        )
         async with httpx.AsyncClient(timeout=30.0) as client:
             resp = await client.post(f"{base_url}/email", json=data, headers=headers)
 
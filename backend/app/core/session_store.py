@@ -0,0 +1,670 @@
+import heapq
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+from app.core.logger import get_logger
+
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "24"))
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", "256"))
+SESSION_DISK_BUDGET_MB = float(os.getenv("SESSION_DISK_BUDGET_MB", "10240"))
+SESSION_DIR = os.getenv("SESSION_DIR", os.path.join(tempfile.gettempdir(), "qhuube_sessions"))
+# "filesystem" is shared by every worker using the same SESSION_DIR;
+# "memory" keeps sessions in the worker process (single worker only)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "filesystem").lower()
+
+FRAME_KEY = "original_df"
+UPLOAD_KEY = "original_file_content"
+UPLOAD_PATH_KEY = "original_file_path"
+
+META_FILE = "meta.pkl"
+FRAME_FILE = "frame.arrow"
+FRAME_PICKLE_FILE = "frame.pkl"
+UPLOAD_FILE = "upload.bin"
+ARTIFACT_FILE = "artifact-{name}.pkl"
+# Under SESSION_DIR: spooled uploads owned by the memory backend
+MEMORY_UPLOAD_DIR = "memory-uploads"
+
+# In-progress writes older than this are assumed abandoned by a dead worker
+STALE_WRITE_SECONDS = 3600
+
+logger = get_logger("sessions")
+
+
+# Lists longer than this are sized from an evenly spaced sample
+SIZE_SAMPLE_ITEMS = 256
+
+
+# Rough deep size of a session payload in bytes
+def estimate_size(value: Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)) and len(value) > SIZE_SAMPLE_ITEMS:
+        # Long row-number lists: scale up a sample instead of walking them
+        sample = value[:: len(value) // SIZE_SAMPLE_ITEMS][:SIZE_SAMPLE_ITEMS]
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in sample) * len(value) // len(sample)
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+# Persist a DataFrame as an uncompressed Arrow IPC (Feather) file so it can be
+# read back without decoding. Frames Arrow cannot represent (mixed-type object
+# columns, non-string headers) are pickled instead.
+def write_frame(df: pd.DataFrame, directory: str) -> str:
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        feather.write_feather(table, os.path.join(directory, FRAME_FILE), compression="uncompressed")
+        return FRAME_FILE
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, ValueError, TypeError) as e:
+        logger.info("Storing session frame as pickle (not Arrow compatible: %s)", e)
+        df.to_pickle(os.path.join(directory, FRAME_PICKLE_FILE))
+        return FRAME_PICKLE_FILE
+
+
+# Fresh DataFrame of a stored frame. The Arrow file is memory-mapped, so only
+# to_pandas() allocates: the caller gets one full in-heap copy, not two.
+def read_frame(directory: str) -> pd.DataFrame:
+    arrow_path = os.path.join(directory, FRAME_FILE)
+    if os.path.exists(arrow_path):
+        return feather.read_table(arrow_path, memory_map=True).to_pandas()
+    return pd.read_pickle(os.path.join(directory, FRAME_PICKLE_FILE))
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _directory_size(directory: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+class SessionBackend(ABC):
+    """
+    Interface shared by the session stores behind get_session_store().
+
+    A session is a dict with at least a "timestamp" plus the parsed frame
+    ("original_df") and the raw upload, either as bytes
+    ("original_file_content") or as a spooled file ("original_file_path")
+    that the store takes ownership of and deletes with the session. `get`
+    returns the session metadata (or None if missing/expired) and is what
+    validate_session uses; `store[session_id]` returns the full session with
+    a fresh "original_df" the caller may modify, and "original_file_content"
+    or "original_file_path" for the upload.
+
+    Results derived from a session (enrichment, reports) can be attached with
+    `put_artifact`; they are deleted with the session, and every
+    `get_artifact` returns a fresh copy.
+    """
+
+    @abstractmethod
+    def put(self, session_id: str, data: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def evict_expired(self, now: Optional[datetime] = None) -> list[str]:
+        ...
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def get_artifact(self, session_id: str, name: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def put_artifact(self, session_id: str, name: str, value: Any) -> None:
+        ...
+
+    @abstractmethod
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def __delitem__(self, session_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def __setitem__(self, session_id: str, data: Dict[str, Any]) -> None:
+        self.put(session_id, data)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+
+class MemorySessionBackend(SessionBackend):
+    """
+    In-process session store with a total memory budget. Only usable with a
+    single worker, since other processes cannot see its sessions.
+
+    Spooled uploads are moved into `upload_dir`, so the spool cleanup cannot
+    delete them while their session is alive. Uploads left there by a
+    previous process are removed on start, since their sessions died with it.
+
+    Sessions expire `ttl` after their "timestamp"; expiry is tracked in a
+    min-heap so cleanup only touches sessions that are actually due. When the
+    bytes held go over the budget the least recently used sessions are
+    evicted first.
+    """
+
+    def __init__(self, ttl: timedelta, memory_budget_bytes: int, upload_dir: str):
+        self.ttl = ttl
+        self.memory_budget_bytes = memory_budget_bytes
+        self.upload_dir = upload_dir
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._artifacts: Dict[str, Dict[str, bytes]] = {}
+        self._expiry_heap: list[tuple[datetime, str]] = []
+        self._lock = threading.RLock()
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired_evictions = 0
+        self.memory_evictions = 0
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        os.makedirs(upload_dir, exist_ok=True)
+
+    def _expires_at(self, data: Dict[str, Any]) -> datetime:
+        return data["timestamp"] + self.ttl
+
+    def _take_upload(self, session_id: str, upload_path: str) -> str:
+        """Move a spooled upload into upload_dir; returns its new path."""
+        if os.path.dirname(os.path.abspath(upload_path)) == os.path.abspath(self.upload_dir):
+            return upload_path
+        suffix = os.path.splitext(upload_path)[1]
+        fd, path = tempfile.mkstemp(prefix=f"{session_id}-", suffix=suffix, dir=self.upload_dir)
+        os.close(fd)
+        # A rename when the spool file is on the same filesystem
+        shutil.move(upload_path, path)
+        return path
+
+    def _remove(self, session_id: str, keep_upload: Optional[str] = None) -> None:
+        data = self._sessions.pop(session_id, None)
+        self._artifacts.pop(session_id, None)
+        self.bytes_held -= self._sizes.pop(session_id, 0)
+        upload_path = data.get(UPLOAD_PATH_KEY) if data is not None else None
+        if upload_path and upload_path != keep_upload:
+            _remove_file(upload_path)
+
+    def put(self, session_id: str, data: Dict[str, Any]) -> None:
+        if data.get(UPLOAD_PATH_KEY):
+            data = {**data, UPLOAD_PATH_KEY: self._take_upload(session_id, data[UPLOAD_PATH_KEY])}
+        size = estimate_size(data)
+        with self._lock:
+            self._remove(session_id, keep_upload=data.get(UPLOAD_PATH_KEY))
+            self._sessions[session_id] = data
+            self._sizes[session_id] = size
+            self.bytes_held += size
+            heapq.heappush(self._expiry_heap, (self._expires_at(data), session_id))
+            self._enforce_budget()
+
+    def _live(self, session_id: str) -> Optional[Dict[str, Any]]:
+        data = self._sessions.get(session_id)
+        if data is not None and datetime.now() >= self._expires_at(data):
+            self._remove(session_id)
+            self.expired_evictions += 1
+            data = None
+        return data
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return the session (marking it recently used) or None if missing/expired."""
+        with self._lock:
+            data = self._live(session_id)
+            if data is None:
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return data
+
+    def evict_expired(self, now: Optional[datetime] = None) -> list[str]:
+        """Drop sessions whose TTL has passed. Cost is O(k log n) for k expired sessions."""
+        now = now or datetime.now()
+        expired = []
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, session_id = heapq.heappop(self._expiry_heap)
+                data = self._sessions.get(session_id)
+                # Skip heap entries left behind by deleted or replaced sessions
+                if data is None or self._expires_at(data) != expires_at:
+                    continue
+                self._remove(session_id)
+                self.expired_evictions += 1
+                expired.append(session_id)
+        return expired
+
+    def _enforce_budget(self) -> None:
+        # The newest session is always last, so it is never evicted here
+        while self.bytes_held > self.memory_budget_bytes and len(self._sessions) > 1:
+            session_id = next(iter(self._sessions))
+            logger.info("Evicting session %s to stay within the session memory budget", session_id)
+            self._remove(session_id)
+            self.memory_evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes_held": self.bytes_held,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired_evictions": self.expired_evictions,
+                "memory_evictions": self.memory_evictions,
+            }
+
+    def get_artifact(self, session_id: str, name: str) -> Optional[Any]:
+        with self._lock:
+            if self._live(session_id) is None:
+                return None
+            blob = self._artifacts.get(session_id, {}).get(name)
+        return pickle.loads(blob) if blob is not None else None
+
+    def put_artifact(self, session_id: str, name: str, value: Any) -> None:
+        # Kept pickled so callers can never modify the cached copy
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._live(session_id) is None:
+                return
+            artifacts = self._artifacts.setdefault(session_id, {})
+            delta = len(blob) - len(artifacts.get(name, b""))
+            artifacts[name] = blob
+            self._sizes[session_id] += delta
+            self.bytes_held += delta
+            self._sessions.move_to_end(session_id)
+            self._enforce_budget()
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        with self._lock:
+            data = self._live(session_id)
+        if data is None:
+            raise KeyError(session_id)
+        # Routes modify the frame they get back, so hand out a copy
+        frame = data.get(FRAME_KEY)
+        return {**data, FRAME_KEY: frame.copy() if frame is not None else None}
+
+    def __delitem__(self, session_id: str) -> None:
+        with self._lock:
+            if session_id not in self._sessions:
+                raise KeyError(session_id)
+            self._remove(session_id)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class _SessionEntry:
+    __slots__ = ("expires_at", "disk_bytes", "meta", "meta_bytes")
+
+    def __init__(self, expires_at: datetime, disk_bytes: int):
+        self.expires_at = expires_at
+        self.disk_bytes = disk_bytes
+        self.meta: Optional[Dict[str, Any]] = None
+        self.meta_bytes = 0
+
+
+class FileSessionBackend(SessionBackend):
+    """
+    Disk-backed store for uploaded file sessions, shared by every worker
+    process pointing at the same directory.
+
+    Each session is a directory holding the parsed frame as an Arrow IPC file,
+    the raw upload and a small pickled metadata dict. Frames are only read
+    back into memory on access, so idle sessions cost disk rather than RAM. Sessions are
+    published with an atomic rename, so a worker that has not seen a session
+    yet (written by another worker, or before a restart) picks it up from
+    disk on first access.
+
+    Sessions expire `ttl` after their "timestamp"; expiry is tracked in a
+    min-heap so cleanup only touches sessions that are actually due. Least
+    recently used sessions are deleted when the disk budget is exceeded, and
+    cached metadata is dropped (not the session) when over the memory budget.
+    Both budgets are enforced per worker over the sessions it has seen.
+    """
+
+    def __init__(self, directory: str, ttl: timedelta, memory_budget_bytes: int, disk_budget_bytes: int):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory_budget_bytes = memory_budget_bytes
+        self.disk_budget_bytes = disk_budget_bytes
+        self._sessions: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._expiry_heap: list[tuple[datetime, str]] = []
+        self._lock = threading.RLock()
+        self.bytes_held = 0
+        self.bytes_on_disk = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired_evictions = 0
+        self.disk_evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_existing()
+
+    def _session_dir(self, session_id: str) -> str:
+        return os.path.join(self.directory, session_id)
+
+    def _load_existing(self) -> None:
+        """Index sessions already on disk, written by other workers or a previous process."""
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            meta_path = os.path.join(entry.path, META_FILE)
+            if entry.name.startswith("."):
+                # Another worker may still be writing this one; only clear
+                # leftovers of a put that was interrupted long ago
+                try:
+                    if time.time() - entry.stat().st_mtime > STALE_WRITE_SECONDS:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                created = datetime.fromtimestamp(os.path.getmtime(meta_path))
+            except FileNotFoundError:
+                continue
+            found.append((created, entry.name, entry.path))
+
+        now = datetime.now()
+        for created, session_id, path in sorted(found):
+            if created + self.ttl <= now:
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                self._add_entry(session_id, _SessionEntry(created + self.ttl, _directory_size(path)))
+            except FileNotFoundError:
+                continue  # Removed by another worker meanwhile
+        if self._sessions:
+            logger.info("Restored %d sessions from %s", len(self._sessions), self.directory)
+
+    def _add_entry(self, session_id: str, entry: _SessionEntry) -> None:
+        self._sessions[session_id] = entry
+        self.bytes_on_disk += entry.disk_bytes
+        heapq.heappush(self._expiry_heap, (entry.expires_at, session_id))
+
+    def _drop_meta(self, entry: _SessionEntry) -> None:
+        self.bytes_held -= entry.meta_bytes
+        entry.meta = None
+        entry.meta_bytes = 0
+
+    def _cache_meta(self, session_id: str, entry: _SessionEntry, meta: Dict[str, Any]) -> None:
+        entry.meta = meta
+        entry.meta_bytes = estimate_size(meta)
+        self.bytes_held += entry.meta_bytes
+        self._enforce_memory_budget(keep=session_id)
+
+    def _forget(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._drop_meta(entry)
+            self.bytes_on_disk -= entry.disk_bytes
+
+    def _remove(self, session_id: str) -> None:
+        self._forget(session_id)
+        shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+
+    def _adopt(self, session_id: str) -> Optional[_SessionEntry]:
+        """Index a session this worker has not seen yet, if it exists on disk."""
+        session_dir = self._session_dir(session_id)
+        if os.path.basename(session_dir) != session_id or session_id.startswith("."):
+            return None  # Not a plain session id, never look outside the directory
+        try:
+            created = datetime.fromtimestamp(os.path.getmtime(os.path.join(session_dir, META_FILE)))
+            entry = _SessionEntry(created + self.ttl, _directory_size(session_dir))
+        except FileNotFoundError:
+            return None
+        self._add_entry(session_id, entry)
+        return entry
+
+    def put(self, session_id: str, data: Dict[str, Any]) -> None:
+        meta = {k: v for k, v in data.items() if k not in (FRAME_KEY, UPLOAD_KEY, UPLOAD_PATH_KEY)}
+
+        # Write into a temporary directory first so readers never see half a session
+        final_dir = self._session_dir(session_id)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{session_id}-", dir=self.directory)
+        try:
+            if data.get(FRAME_KEY) is not None:
+                write_frame(data[FRAME_KEY], tmp_dir)
+            if data.get(UPLOAD_PATH_KEY):
+                # A rename when the spool file is on the same filesystem
+                shutil.move(data[UPLOAD_PATH_KEY], os.path.join(tmp_dir, UPLOAD_FILE))
+            elif data.get(UPLOAD_KEY) is not None:
+                with open(os.path.join(tmp_dir, UPLOAD_FILE), "wb") as f:
+                    f.write(data[UPLOAD_KEY])
+            meta_path = os.path.join(tmp_dir, META_FILE)
+            with open(meta_path, "wb") as f:
+                pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # The metadata mtime records the session timestamp for restarts
+            created = meta["timestamp"].timestamp()
+            os.utime(meta_path, (created, created))
+            disk_bytes = _directory_size(tmp_dir)
+
+            with self._lock:
+                self._remove(session_id)
+                os.replace(tmp_dir, final_dir)
+                entry = _SessionEntry(meta["timestamp"] + self.ttl, disk_bytes)
+                self._add_entry(session_id, entry)
+                self._cache_meta(session_id, entry, meta)
+                self._enforce_disk_budget()
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def _live_entry(self, session_id: str) -> Optional[_SessionEntry]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._adopt(session_id)
+        elif not os.path.isdir(self._session_dir(session_id)):
+            # Expired or evicted by another worker
+            self._forget(session_id)
+            return None
+        if entry is not None and datetime.now() >= entry.expires_at:
+            self._remove(session_id)
+            self.expired_evictions += 1
+            entry = None
+        return entry
+
+    def _meta(self, session_id: str, entry: _SessionEntry) -> Optional[Dict[str, Any]]:
+        if entry.meta is None:
+            try:
+                with open(os.path.join(self._session_dir(session_id), META_FILE), "rb") as f:
+                    self._cache_meta(session_id, entry, pickle.load(f))
+            except FileNotFoundError:
+                self._forget(session_id)
+                return None
+        return entry.meta
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return session metadata (marking it recently used) or None if missing/expired."""
+        with self._lock:
+            entry = self._live_entry(session_id)
+            meta = self._meta(session_id, entry) if entry is not None else None
+            if meta is None:
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return meta
+
+    def evict_expired(self, now: Optional[datetime] = None) -> list[str]:
+        """Drop sessions whose TTL has passed. Cost is O(k log n) for k expired sessions."""
+        now = now or datetime.now()
+        expired = []
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, session_id = heapq.heappop(self._expiry_heap)
+                entry = self._sessions.get(session_id)
+                # Skip heap entries left behind by deleted or replaced sessions
+                if entry is None or entry.expires_at != expires_at:
+                    continue
+                self._remove(session_id)
+                self.expired_evictions += 1
+                expired.append(session_id)
+        return expired
+
+    def _enforce_disk_budget(self) -> None:
+        # The newest session is always last, so it is never evicted here
+        while self.bytes_on_disk > self.disk_budget_bytes and len(self._sessions) > 1:
+            session_id = next(iter(self._sessions))
+            logger.info("Evicting session %s to stay within the session disk budget", session_id)
+            self._remove(session_id)
+            self.disk_evictions += 1
+
+    def _enforce_memory_budget(self, keep: str) -> None:
+        if self.bytes_held <= self.memory_budget_bytes:
+            return
+        for session_id, entry in self._sessions.items():
+            if self.bytes_held <= self.memory_budget_bytes:
+                break
+            if session_id != keep and entry.meta is not None:
+                self._drop_meta(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "filesystem",
+                "directory": self.directory,
+                "sessions": len(self._sessions),
+                "bytes_held": self.bytes_held,
+                "bytes_on_disk": self.bytes_on_disk,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "disk_budget_bytes": self.disk_budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired_evictions": self.expired_evictions,
+                "disk_evictions": self.disk_evictions,
+            }
+
+    def _artifact_path(self, session_id: str, name: str) -> str:
+        return os.path.join(self._session_dir(session_id), ARTIFACT_FILE.format(name=name))
+
+    def get_artifact(self, session_id: str, name: str) -> Optional[Any]:
+        with self._lock:
+            if self._live_entry(session_id) is None:
+                return None
+        try:
+            with open(self._artifact_path(session_id, name), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put_artifact(self, session_id: str, name: str, value: Any) -> None:
+        session_dir = self._session_dir(session_id)
+        path = self._artifact_path(session_id, name)
+        try:
+            # Write next to the target and rename, so readers in other
+            # workers never load a partial file
+            fd, tmp_path = tempfile.mkstemp(prefix=".artifact-", dir=session_dir)
+        except FileNotFoundError:
+            return  # Session deleted meanwhile
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(tmp_path)
+            with self._lock:
+                entry = self._live_entry(session_id)
+                if entry is None:
+                    os.remove(tmp_path)
+                    return
+                old_size = os.path.getsize(path) if os.path.exists(path) else 0
+                os.replace(tmp_path, path)
+                entry.disk_bytes += size - old_size
+                self.bytes_on_disk += size - old_size
+                self._sessions.move_to_end(session_id)
+                self._enforce_disk_budget()
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        """Full session: metadata plus a fresh copy of the frame and the upload path."""
+        with self._lock:
+            entry = self._live_entry(session_id)
+            meta = self._meta(session_id, entry) if entry is not None else None
+        if meta is None:
+            raise KeyError(session_id)
+        session_dir = self._session_dir(session_id)
+        upload_path = os.path.join(session_dir, UPLOAD_FILE)
+        try:
+            frame = read_frame(session_dir)
+        except FileNotFoundError:
+            if not os.path.isdir(session_dir):
+                raise KeyError(session_id)
+            frame = None  # Session stored without a frame
+        return {
+            **meta,
+            FRAME_KEY: frame,
+            UPLOAD_PATH_KEY: upload_path if os.path.exists(upload_path) else None,
+        }
+
+    def __delitem__(self, session_id: str) -> None:
+        with self._lock:
+            if self._live_entry(session_id) is None:
+                raise KeyError(session_id)
+            self._remove(session_id)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+# Build the session backend selected by SESSION_BACKEND
+def create_session_backend(backend: str = SESSION_BACKEND) -> SessionBackend:
+    ttl = timedelta(hours=SESSION_TTL_HOURS)
+    memory_budget_bytes = int(SESSION_MEMORY_BUDGET_MB * 1024 * 1024)
+    if backend == "memory":
+        return MemorySessionBackend(
+            ttl=ttl,
+            memory_budget_bytes=memory_budget_bytes,
+            upload_dir=os.path.join(SESSION_DIR, MEMORY_UPLOAD_DIR),
+        )
+    if backend == "filesystem":
+        return FileSessionBackend(
+            directory=SESSION_DIR,
+            ttl=ttl,
+            memory_budget_bytes=memory_budget_bytes,
+            disk_budget_bytes=int(SESSION_DISK_BUDGET_MB * 1024 * 1024),
+        )
+    raise ValueError(f"Unknown SESSION_BACKEND '{backend}' (expected 'filesystem' or 'memory')")
+
+
+_session_store: Optional[SessionBackend] = None
+_session_store_lock = threading.Lock()
+
+
+# The process's session store. Built on first use rather than on import, since
+# building it sweeps SESSION_DIR; main.py builds it in its startup hook.
+def get_session_store() -> SessionBackend:
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = create_session_backend()
+    return _session_store
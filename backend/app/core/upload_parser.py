@@ -0,0 +1,172 @@
+import csv
+import importlib.util
+import os
+from typing import Iterable, List, Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pacsv
+from app.core.logger import get_logger
+
+logger = get_logger("upload")
+
+# python-calamine (Rust) reads .xlsx about 10x faster than openpyxl and
+# gives pandas the same values; without it openpyxl is used
+XLSX_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else "openpyxl"
+
+# Parse CSV/TXT uploads with the multithreaded pyarrow reader; "false" uses
+# pandas only
+UPLOAD_ARROW_CSV = os.getenv("UPLOAD_ARROW_CSV", "true").lower() == "true"
+# Only parse columns whose header matches a configured alias. Off by
+# default: unmapped columns are still echoed in the annotated workbook and
+# the VAT reports.
+UPLOAD_PROJECT_COLUMNS = os.getenv("UPLOAD_PROJECT_COLUMNS", "false").lower() == "true"
+
+# Same cells pandas reads as NaN by default
+NULL_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null",
+]
+ARROW_STRING = pd.StringDtype("pyarrow")
+
+
+def _delimiter(filename: str) -> str:
+    return "\t" if filename.endswith(".txt") else ","
+
+
+def _header_row(path: str, delimiter: str) -> List[str]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f, delimiter=delimiter), [])
+
+
+# Header names of `columns` that match one of `keep_columns` (lowercased
+# aliases), or None to read every column
+def projected_columns(columns: Iterable, keep_columns: Optional[set]) -> Optional[List]:
+    if not keep_columns:
+        return None
+    selected = [col for col in columns if str(col).strip().lower() in keep_columns]
+    # Nothing recognisable: read everything so the missing headers get reported
+    return selected or None
+
+
+def _convert_options(include_columns: Optional[List], column_types: Optional[dict] = None):
+    return pacsv.ConvertOptions(
+        include_columns=include_columns,
+        column_types=column_types,
+        null_values=NULL_VALUES,
+        strings_can_be_null=True,
+        # pandas only reads True/False as booleans
+        true_values=["True", "TRUE", "true"],
+        false_values=["False", "FALSE", "false"],
+    )
+
+
+# CSV/TSV through pyarrow: text columns become string[pyarrow], everything
+# else the same numpy dtypes pandas would infer. Returns None for files the
+# pandas reader has to handle (duplicate or blank header names).
+def read_csv_arrow(path: str, delimiter: str, keep_columns: Optional[set] = None) -> Optional[pd.DataFrame]:
+    header = _header_row(path, delimiter)
+    if not header or len(set(header)) != len(header) or any(not h.strip() for h in header):
+        return None
+
+    include_columns = projected_columns(header, keep_columns)
+    read_options = pacsv.ReadOptions(use_threads=True)
+    parse_options = pacsv.ParseOptions(delimiter=delimiter)
+    table = pacsv.read_csv(
+        path,
+        read_options=read_options,
+        parse_options=parse_options,
+        convert_options=_convert_options(include_columns),
+    )
+
+    # pandas leaves dates and times as text. YYYY-MM-DD dates cast back
+    # exactly; other temporal columns are re-read as strings.
+    reread = [f.name for f in table.schema if pa.types.is_timestamp(f.type) or pa.types.is_time(f.type)]
+    if reread:
+        text = pacsv.read_csv(
+            path,
+            read_options=read_options,
+            parse_options=parse_options,
+            convert_options=_convert_options(reread, {name: pa.string() for name in reread}),
+        )
+    for i, field in enumerate(table.schema):
+        if field.name in reread:
+            table = table.set_column(i, field.name, text.column(field.name))
+        elif pa.types.is_date(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+        elif pa.types.is_null(field.type):
+            # All-empty columns are float NaN in pandas
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+
+    return table.to_pandas(
+        types_mapper={pa.string(): ARROW_STRING, pa.large_string(): ARROW_STRING}.get
+    )
+
+
+def read_csv_pandas(path: str, delimiter: str, keep_columns: Optional[set] = None) -> pd.DataFrame:
+    usecols = None
+    if keep_columns:
+        usecols = lambda col: str(col).strip().lower() in keep_columns
+        if projected_columns(_header_row(path, delimiter), keep_columns) is None:
+            usecols = None
+    return pd.read_csv(path, delimiter=delimiter, usecols=usecols, memory_map=True)
+
+
+# Parse a spooled CSV/TXT/Excel upload (blocking, runs on the worker pool).
+# `keep_columns` optionally limits parsing to the matching headers.
+def read_upload(path: str, filename: str, keep_columns: Optional[set] = None) -> pd.DataFrame:
+    if filename.endswith((".csv", ".txt")):
+        delimiter = _delimiter(filename)
+        if UPLOAD_ARROW_CSV:
+            try:
+                df = read_csv_arrow(path, delimiter, keep_columns)
+                if df is not None:
+                    return df
+            except (pa.ArrowInvalid, UnicodeDecodeError) as e:
+                logger.warning("Arrow CSV reader failed for %s, using pandas: %s", filename, e)
+        return read_csv_pandas(path, delimiter, keep_columns)
+
+    return read_excel_upload(path, filename, keep_columns)
+
+
+# First sheet of an Excel upload. .xlsx goes through XLSX_ENGINE, .xls
+# through pandas' default (xlrd). With `keep_columns` only the matching
+# columns are converted.
+def read_excel_upload(path: str, filename: str, keep_columns: Optional[set] = None) -> pd.DataFrame:
+    is_xlsx = filename.endswith(".xlsx")
+    usecols = None
+    if keep_columns:
+        if projected_columns(read_upload_header(path, filename), keep_columns) is not None:
+            usecols = lambda col: str(col).strip().lower() in keep_columns
+    return pd.read_excel(
+        path, sheet_name=0, engine=XLSX_ENGINE if is_xlsx else None, usecols=usecols
+    )
+
+
+# Column names of an upload's header row, as read_upload would name them,
+# without parsing any data rows
+def read_upload_header(path: str, filename: str) -> List:
+    if filename.endswith((".csv", ".txt")):
+        return pd.read_csv(path, delimiter=_delimiter(filename), nrows=0).columns.tolist()
+    # openpyxl in read-only mode only has to stream the first row
+    engine = "openpyxl" if filename.endswith(".xlsx") else None
+    return pd.read_excel(path, sheet_name=0, nrows=0, engine=engine).columns.tolist()
+
+
+# Raw bytes of a spooled upload, e.g. to attach it to an email
+def read_upload_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# Turn string[pyarrow] columns back into object columns (NaN for missing),
+# which is what the enrichment and report code expects
+def with_object_strings(df: pd.DataFrame) -> pd.DataFrame:
+    string_columns = [col for col in df.columns if isinstance(df[col].dtype, pd.StringDtype)]
+    if not string_columns:
+        return df
+    df = df.copy(deep=False)
+    for col in string_columns:
+        df[col] = df[col].to_numpy(dtype=object, na_value=np.nan)
+    return df
@@ -0,0 +1,62 @@
+import hashlib
+import os
+import tempfile
+import time
+from typing import NamedTuple
+from fastapi import UploadFile
+
+# Uploads are streamed here before parsing; the session store then takes the
+# file over. Same filesystem as SESSION_DIR means a rename instead of a copy.
+UPLOAD_SPOOL_DIR = os.getenv(
+    "UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "qhuube_uploads")
+)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Spool files older than this were left behind by a request that died
+STALE_SPOOL_SECONDS = 3600
+
+
+class SpooledUpload(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+
+
+# Stream an upload to a temp file in chunks, hashing it on the way, so the
+# raw bytes are never held in memory as a whole
+async def spool_upload(file: UploadFile) -> SpooledUpload:
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=suffix, dir=UPLOAD_SPOOL_DIR)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        discard_spooled_upload(path)
+        raise
+    return SpooledUpload(path=path, size=size, sha256=digest.hexdigest())
+
+
+def discard_spooled_upload(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Remove spool files abandoned by crashed or killed requests
+def cleanup_stale_spools() -> None:
+    if not os.path.isdir(UPLOAD_SPOOL_DIR):
+        return
+    cutoff = time.time() - STALE_SPOOL_SECONDS
+    for entry in os.scandir(UPLOAD_SPOOL_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,168 @@
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from app.core.helper import (
+    normalize_string,
+    safe_float,
+    safe_round,
+    safe_round_array,
+    parse_date_column,
+)
+from app.core.currency_conversion import FxRateIndex
+from app.core.logger import get_logger
+
+logger = get_logger("enrichment")
+
+NOT_FOUND = "Not Found"
+
+VAT_TABLE_KEYS = ["product_type", "country"]
+
+
+# Build the (product_type, country) -> VAT rates table used for the join.
+# Rates are stored as rounded fractions, exactly like the per-row lookup did.
+def build_vat_table(vat_products: List[Dict]) -> pd.DataFrame:
+    rates = {}
+    for prod in vat_products:
+        try:
+            product_type = normalize_string(str(prod.get("product_type", "")))
+            country = normalize_string(str(prod.get("country", "")))
+            if product_type and country:
+                rates[(product_type, country)] = (
+                    safe_round(safe_float(prod.get("vat_rate", 2)) / 100, 2),
+                    safe_round(safe_float(prod.get("shipping_vat_rate", 2)) / 100, 2),
+                )
+        except Exception as prod_error:
+            logger.warning("Error processing VAT product: %s", prod_error)
+            continue
+
+    index = pd.MultiIndex.from_tuples(list(rates.keys()), names=VAT_TABLE_KEYS)
+    values = np.array(list(rates.values()), dtype=float).reshape(-1, 2)
+    return pd.DataFrame(
+        {"vat_rate": values[:, 0], "shipping_vat_rate": values[:, 1]}, index=index
+    )
+
+
+# Normalize a text column once per distinct value instead of once per row.
+# Values are normalized as their str() form, like series.astype(str).
+def normalize_column(series: pd.Series) -> np.ndarray:
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    uniques = list(uniques)
+    if not all(isinstance(value, str) or value is np.nan for value in uniques):
+        # Factorizing mixed objects can merge e.g. 1 and 1.0, whose text differs
+        codes, uniques = pd.factorize(series.astype(str), use_na_sentinel=False)
+    normalized = np.array([normalize_string(str(value)) for value in uniques], dtype=object)
+    return normalized[codes]
+
+
+# Join normalized (product_type, country) pairs against the VAT table.
+# Returns the VAT rate, shipping VAT rate and a mask of rows that matched.
+def lookup_vat_rates(
+    product_types: np.ndarray, countries: np.ndarray, vat_table: pd.DataFrame
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    keys = pd.MultiIndex.from_arrays([product_types, countries], names=VAT_TABLE_KEYS)
+    positions = vat_table.index.get_indexer(keys) if len(vat_table) else np.full(len(keys), -1)
+    found = positions >= 0
+
+    vat_rates = np.zeros(len(keys), dtype=float)
+    shipping_vat_rates = np.zeros(len(keys), dtype=float)
+    vat_rates[found] = vat_table["vat_rate"].to_numpy()[positions[found]]
+    shipping_vat_rates[found] = vat_table["shipping_vat_rate"].to_numpy()[positions[found]]
+    return vat_rates, shipping_vat_rates, found
+
+
+# Convert non-EUR prices to EUR with the ECB rate of the order date.
+# The order_date column is parsed once and matched against the FX index as a
+# backward as-of join on (currency, date), so weekends and ECB holidays fall
+# back to the latest earlier rate. Returns converted net/shipping prices, the
+# resulting currency per row and a mask of rows whose order date could not
+# be parsed.
+def convert_prices_to_eur(
+    currencies: np.ndarray,
+    order_dates: Optional[pd.Series],
+    net_prices: np.ndarray,
+    shipping_amounts: np.ndarray,
+    fx_index: FxRateIndex,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    errors = np.zeros(len(currencies), dtype=bool)
+    if order_dates is None:
+        return net_prices, shipping_amounts, currencies.copy(), errors
+
+    # Rows without an order date keep their original currency and prices
+    has_date = np.ones(len(currencies), dtype=bool)
+    if not pd.api.types.is_datetime64_any_dtype(order_dates.dtype):
+        codes, uniques = pd.factorize(order_dates, use_na_sentinel=True)
+        blank = np.array([isinstance(v, str) and v.strip() == "" for v in uniques] + [False])
+        has_date = ~blank[codes]
+    needs_conversion = (currencies != "EUR") & has_date
+    if not needs_conversion.any():
+        return net_prices, shipping_amounts, currencies.copy(), errors
+
+    parsed_dates = parse_date_column(order_dates[needs_conversion])
+    unparseable = np.isnat(parsed_dates)
+    errors[needs_conversion] = unparseable
+    converted = needs_conversion & ~errors
+
+    rates = fx_index.rates_on_or_before(currencies[converted], parsed_dates[~unparseable])
+    missing = np.isnan(rates)
+    if missing.any():
+        # Same 1.0 fallback as FxRateIndex.get_fx_rate, but not silently
+        logger.warning(
+            "No ECB rate for %d rows (%s); prices left unconverted",
+            int(missing.sum()), ", ".join(sorted(set(currencies[converted][missing]))),
+        )
+    fx_rates = 1 / np.where(missing, 1.0, rates)
+
+    net_prices = net_prices.copy()
+    shipping_amounts = shipping_amounts.copy()
+    net_prices[converted] = safe_round_array(net_prices[converted] * fx_rates, 2)
+    shipping_amounts[converted] = safe_round_array(shipping_amounts[converted] * fx_rates, 2)
+    final_currencies = currencies.copy()
+    final_currencies[converted] = "EUR"
+    return net_prices, shipping_amounts, final_currencies, errors
+
+
+# Compute the VAT columns for every row at once. Rows without a VAT match get
+# "Not Found" in the rate/amount columns and 0.0 totals; rows flagged in
+# `errors` get 0.0 everywhere.
+def compute_vat_columns(
+    net_prices: np.ndarray,
+    shipping_amounts: np.ndarray,
+    vat_rates: np.ndarray,
+    shipping_vat_rates: np.ndarray,
+    found: np.ndarray,
+    errors: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    vat_amounts = safe_round_array(vat_rates * net_prices, 2)
+    shipping_vat_amounts = safe_round_array(shipping_vat_rates * shipping_amounts, 2)
+    total_vat = safe_round_array(vat_amounts + shipping_vat_amounts, 2)
+    gross_total = safe_round_array(net_prices + vat_amounts + shipping_vat_amounts, 2)
+
+    matched = found & ~errors
+    not_found = ~found & ~errors
+    columns = {
+        "VAT Rate": vat_rates,
+        "Product VAT": vat_amounts,
+        "Shipping VAT Rate": shipping_vat_rates,
+        "Shipping VAT": shipping_vat_amounts,
+    }
+    result = {}
+    for name, values in columns.items():
+        column = np.where(matched, values, 0.0)
+        if not_found.any():
+            column = column.astype(object)
+            column[not_found] = NOT_FOUND
+        result[name] = column
+    result["Total VAT"] = np.where(matched, total_vat, 0.0)
+    result["Gross Total"] = np.where(matched, gross_total, 0.0)
+    return result
+
+
+# Overall totals for the report, reduced once over the enriched columns
+def summarize_vat_totals(
+    net_prices: np.ndarray, total_vat: np.ndarray, gross_total: np.ndarray
+) -> Dict[str, float]:
+    return {
+        "overall_vat_amount": safe_round(np.sum(total_vat, dtype=float), 2),
+        "overall_net_price": safe_round(np.sum(net_prices, dtype=float), 2),
+        "overall_gross_total": safe_round(np.sum(gross_total, dtype=float), 2),
+    }
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import time
+from typing import NamedTuple, Optional
+import pandas as pd
+from app.core.vat_enrichment import build_vat_table
+from app.models.product_model import get_vat_rate_products
+from app.models.reference_version_model import get_reference_versions, PRODUCTS
+from app.core.logger import get_logger
+from app.core.metrics import cache_lookup
+
+logger = get_logger("reference")
+
+# How often a worker reloads the VAT table when callers do not pass the
+# current "products" reference version; edits made through this process
+# apply immediately
+VAT_TABLE_REFRESH_SECONDS = int(os.getenv("VAT_TABLE_REFRESH_SECONDS", "600"))
+
+
+class CachedVatTable(NamedTuple):
+    version: int  # "products" reference version the table was loaded at
+    table: pd.DataFrame  # build_vat_table output; shared, never modify it
+
+
+_vat_table: Optional[CachedVatTable] = None
+_loaded_at: Optional[float] = None
+# Bumped on every invalidation so a reload that raced an edit is not cached
+_generation = 0
+_vat_table_lock = asyncio.Lock()
+
+
+# Drop the cached table; the next get_vat_table() reloads it
+def invalidate_vat_table() -> None:
+    global _vat_table, _generation
+    _vat_table = None
+    _generation += 1
+
+
+def _is_fresh(cached: Optional[CachedVatTable], reference_version: Optional[int]) -> bool:
+    return (
+        cached is not None
+        and time.monotonic() - _loaded_at <= VAT_TABLE_REFRESH_SECONDS
+        and (reference_version is None or reference_version <= cached.version)
+    )
+
+
+# Process-wide (product_type, country) -> VAT rates table; only reads the
+# products collection on first use, after a local product edit or import,
+# after the refresh interval or when `reference_version` is newer
+async def get_vat_table(reference_version: Optional[int] = None) -> pd.DataFrame:
+    global _vat_table, _loaded_at
+    if _is_fresh(_vat_table, reference_version):
+        cache_lookup("vat_table", True)
+        return _vat_table.table
+    cache_lookup("vat_table", False)
+
+    async with _vat_table_lock:
+        # Another request may have reloaded it while we waited
+        cached = _vat_table
+        if not _is_fresh(cached, reference_version):
+            generation = _generation
+            version = (await get_reference_versions())[PRODUCTS]
+            table = build_vat_table(await get_vat_rate_products())
+            if len(table):
+                # Build the hash index now rather than on the first lookup,
+                # which may happen on several worker threads at once
+                table.index.get_indexer(table.index[:1])
+            cached = CachedVatTable(version, table)
+            if generation == _generation:
+                _vat_table, _loaded_at = cached, time.monotonic()
+            logger.info("VAT table loaded: %d entries (version %d)", len(table), version)
+        return cached.table
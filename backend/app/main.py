@@ -5,10 +5,30 @@ from itertools import product
 
 from app.routes import auth, header, product, currency, offer
 from app.core import validate_file
-from app.routes import email_report
+from app.core.executor import executor
+from app.core.metrics import start_metrics_writer, stop_metrics_writer
+from app.core.session_store import get_session_store
+from app.routes import email_report, metrics
 
 app = FastAPI(title="Qhuube Tax Compliance")
 
+
+@app.on_event("startup")
+def start_session_store():
+    get_session_store()
+
+
+@app.on_event("startup")
+def start_metrics():
+    start_metrics_writer()
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    executor.shutdown()
+    stop_metrics_writer()
+
+
 app.include_router(auth.router, prefix="/auth", tags=["Auth"])
 app.include_router(header.router, prefix="/api/v1", tags=["Header"])
 app.include_router(product.router, prefix="/api/v1", tags=["Product"])
@@ -16,6 +36,7 @@ app.include_router(validate_file.router, prefix="/api/v1", tags=["File Validatio
 app.include_router(currency.router, prefix="/api/v1", tags=["Currency Rates"])
 app.include_router(offer.router, prefix="/api/v1", tags=["Offer"])
 app.include_router(email_report.router, prefix="/api/v1", tags=["Email"]) 
+app.include_router(metrics.router, tags=["Metrics"])
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,4 +44,5 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Disposition", "ETag"],
 )
@@ -1,5 +1,7 @@
 import httpx
 from app.core.database import db
+from app.core.currency_conversion import refresh_fx_index
+from app.models.reference_version_model import bump_reference_version, CURRENCY_UPDATE
 from app.schemas.currencies_schemas import CurrencyUpdate
 from app.utils.country_mapping import currency_country_map
 
@@ -58,6 +60,8 @@ async def fetch_two_years_ecb_rates():
     # Insert all documents
     if all_documents:
         await currency_update_col.insert_many(all_documents)
+        version = await bump_reference_version(CURRENCY_UPDATE)
+        await refresh_fx_index(full=True, reference_version=version)
         print(f"\nInserted {len(all_documents)} total records into `currency_update`.")
         
         # Show summary
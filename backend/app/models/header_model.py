@@ -1,10 +1,13 @@
 from app.core.database import db
 from bson import ObjectId
+from app.models.reference_version_model import bump_reference_version, HEADERS
+from app.core.metrics import mongo_roundtrip
 
 async def get_header_by_label(label: str):
     return await db["headers"].find_one({"label": label})
 
 async def get_all_headers():
+    mongo_roundtrip("headers.find")
     headers_cursor = db.headers.find({}).sort("created_at", -1)
     headers = await headers_cursor.to_list(length=None)
     # Convert ObjectId to string for each header
@@ -22,6 +25,7 @@ async def create_header(label: str, value: str, aliases: list[str], type: str):
         "type": type
     }
     result = await db.headers.insert_one(header)
+    await bump_reference_version(HEADERS)
     header["_id"] = str(result.inserted_id)  # Convert to string immediately
     return header
 
@@ -39,6 +43,7 @@ async def update_header(header_id: str, label: str, value: str, aliases: list[st
     )
     if result.modified_count == 0:
         raise Exception("Header not found or no changes made")
+    await bump_reference_version(HEADERS)
     
     # Fixed typo: find_one instead of findOne
     updated_header = await db.headers.find_one({"_id": ObjectId(header_id)})
@@ -51,6 +56,7 @@ async def delete_header(header_id: str):
     result = await db.headers.delete_one({"_id": ObjectId(header_id)})
     if result.deleted_count == 0:
         raise Exception("Header not found or already deleted")
+    await bump_reference_version(HEADERS)
     
     return {
         "success": True,
@@ -1,8 +1,11 @@
 from app.core.database import db
 from bson import ObjectId
 from datetime import datetime
+from app.models.reference_version_model import bump_reference_version, PRODUCTS
+from app.core.metrics import mongo_roundtrip
 
 async def get_all_products():
+    mongo_roundtrip("products.find")
     product_cursor = db.products.find({}).sort("created_at", -1)
     products = await product_cursor.to_list(length=None)
     # Convert ObjectId to string for each product
@@ -16,6 +19,12 @@ async def get_all_products():
             product["updated_at"] = product["updated_at"].isoformat()
     return products
 
+# Only the fields the VAT lookup needs, newest first like get_all_products
+async def get_vat_rate_products():
+    projection = {"_id": 0, "product_type": 1, "country": 1, "vat_rate": 1, "shipping_vat_rate": 1}
+    mongo_roundtrip("products.find")
+    return await db.products.find({}, projection).sort("created_at", -1).to_list(length=None)
+
 async def create_product(product_type: str, country: str, vat_rate: float, vat_category: str, shipping_vat_rate: float):
     current_time = datetime.utcnow()
     product = {
@@ -28,12 +37,30 @@ async def create_product(product_type: str, country: str, vat_rate: float, vat_c
         "updated_at": current_time
     }
     result = await db.products.insert_one(product)
+    await bump_reference_version(PRODUCTS)
     product["_id"] = str(result.inserted_id)
     # Convert datetime to ISO string for response
     product["created_at"] = product["created_at"].isoformat()
     product["updated_at"] = product["updated_at"].isoformat()
     return product
 
+# Insert a batch of products (dicts with the create_product fields) in one
+# write, bumping the products version once. Returns the number inserted.
+async def create_products(products: list) -> int:
+    if not products:
+        return 0
+    current_time = datetime.utcnow()
+    documents = [
+        {**product, "created_at": current_time, "updated_at": current_time}
+        for product in products
+    ]
+    try:
+        result = await db.products.insert_many(documents)
+    finally:
+        # Also after a failed batch, part of it may have been written
+        await bump_reference_version(PRODUCTS)
+    return len(result.inserted_ids)
+
 async def update_product(product_id: str, product_type: str, country: str, vat_rate: float, vat_category: str, shipping_vat_rate: float):
     updated_data = {
         "product_type": product_type,
@@ -49,6 +76,7 @@ async def update_product(product_id: str, product_type: str, country: str, vat_r
     )
     if result.modified_count == 0:
         raise Exception("Product not found or no changes made")
+    await bump_reference_version(PRODUCTS)
     
     updated_product = await db.products.find_one({"_id": ObjectId(product_id)})
     if updated_product:
@@ -64,6 +92,7 @@ async def delete_product(product_id: str):
     result = await db.products.delete_one({"_id": ObjectId(product_id)})
     if result.deleted_count == 0:
         raise Exception("Product not found or already deleted")
+    await bump_reference_version(PRODUCTS)
     
     return {
         "success": True,
@@ -0,0 +1,31 @@
+from pymongo import ReturnDocument
+from app.core.database import db
+from app.core.metrics import mongo_roundtrip
+
+# Reference data whose edits invalidate cached enrichment results
+PRODUCTS = "products"
+CURRENCY_UPDATE = "currency_update"
+HEADERS = "headers"
+REFERENCE_NAMES = (PRODUCTS, CURRENCY_UPDATE, HEADERS)
+
+
+# One counter document per reference collection, e.g. {"_id": "products", "version": 7}
+# Returns the new version
+async def bump_reference_version(name: str) -> int:
+    mongo_roundtrip("reference_versions.update")
+    doc = await db.reference_versions.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc["version"]
+
+
+async def get_reference_versions() -> dict:
+    mongo_roundtrip("reference_versions.find")
+    docs = await db.reference_versions.find({"_id": {"$in": list(REFERENCE_NAMES)}}).to_list(length=None)
+    versions = {name: 0 for name in REFERENCE_NAMES}
+    for doc in docs:
+        versions[doc["_id"]] = doc.get("version", 0)
+    return versions
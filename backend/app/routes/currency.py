@@ -4,6 +4,8 @@ from app.models.currency_model import fetch_two_years_ecb_rates
 from app.utils.country_mapping import currency_country_map
 from app.schemas.currencies_schemas import CurrencyUpdate
 from app.core.database import db
+from app.core.currency_conversion import refresh_fx_index
+from app.models.reference_version_model import bump_reference_version, CURRENCY_UPDATE
 from datetime import datetime, timedelta, timezone
 import aiohttp
 import logging
@@ -178,6 +180,11 @@ async def daily_live_currency_sync():
             logs.append(f"{currency_code}: Failed due to {str(e)}")
             all_failed += 1
 
+    # Make the new rates visible to report generation (other workers see the version bump)
+    if all_inserted > 0:
+        version = await bump_reference_version(CURRENCY_UPDATE)
+        await refresh_fx_index(full=True, reference_version=version)
+
     # Step 4: Final cron status
     if all_inserted > 0:
         cron_status = "Updated"
@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from app.core.security import verify_access_token
 from app.schemas.header_schemas import HeaderSchema, HeaderCreateSchema, HeaderListResponse
 from app.models.header_model import get_all_headers, create_header, update_header, get_header_by_label, delete_header
+from app.core.header_config import invalidate_header_config
 
 router = APIRouter()
 
@@ -18,6 +19,7 @@ async def create_new_header(header: HeaderCreateSchema, admin=Depends(verify_acc
             header.aliases or [],
             header.type
         )
+        invalidate_header_config()
         return created_header
     except HTTPException:
         raise
@@ -46,6 +48,7 @@ async def update_header_in_db(header_id: str, updated: HeaderCreateSchema, admin
             updated.type
 
         )
+        invalidate_header_config()
         return {
             "success": True,
             "header": updated_header
@@ -57,6 +60,7 @@ async def update_header_in_db(header_id: str, updated: HeaderCreateSchema, admin
 async def delete_existing_header(header_id: str, admin=Depends(verify_access_token)):
     try:
         result = await delete_header(header_id)
+        invalidate_header_config()
         return result
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from app.core.security import verify_access_token
+from app.core.executor import executor
+from app.core.metrics import register_stats, render_metrics
+from app.core.session_store import get_session_store
+
+router = APIRouter()
+
+register_stats("executor", executor.stats)
+register_stats("sessions", lambda: get_session_store().stats())
+
+
+# Prometheus text format: stage timings, row/byte counters, cache hits,
+# MongoDB round-trips, executor and session store state. Merged across the
+# worker processes through METRICS_DIR.
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(admin=Depends(verify_access_token)):
+    return PlainTextResponse(
+        render_metrics(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, Depends
 from app.core.security import verify_access_token
 from app.schemas.product_schemas import ProductSchema, ProductCreateSchema, ProductListResponse
-from app.models.product_model import get_all_products, create_product, update_product, delete_product
+from app.models.product_model import get_all_products, create_product, create_products, update_product, delete_product
+from app.core.vat_table import invalidate_vat_table
 from fastapi import UploadFile, File
 from openpyxl import load_workbook
 from io import BytesIO
@@ -18,6 +19,7 @@ async def create_new_product(product: ProductCreateSchema, admin=Depends(verify_
         vat_category=product.vat_category,
         shipping_vat_rate=product.shipping_vat_rate,
     )
+    invalidate_vat_table()
     return ProductSchema(**product_data)
 
 
@@ -40,6 +42,7 @@ async def update_existing_product(product_id: str, updated: ProductCreateSchema,
             vat_category=updated.vat_category,
             shipping_vat_rate=updated.shipping_vat_rate
         )
+        invalidate_vat_table()
         return ProductSchema(**updated_product)
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -48,7 +51,9 @@ async def update_existing_product(product_id: str, updated: ProductCreateSchema,
 @router.delete("/delete/product/{product_id}")
 async def delete_existing_product(product_id: str, admin=Depends(verify_access_token)):
     try:
-        return await delete_product(product_id)
+        result = await delete_product(product_id)
+        invalidate_vat_table()
+        return result
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
 
@@ -76,21 +81,28 @@ async def import_products_json(data: dict, admin=Depends(verify_access_token)):
             normalized[db_key] = value
         return normalized
 
+    # Validate every row first, then insert the valid ones in one batch
+    valid_rows = []
     for idx, row in enumerate(products, start=1):
         try:
             normalized_row = normalize_row(row)
             product = ProductCreateSchema(**normalized_row)
-            await create_product(
-                product_type=product.product_type,
-                country=product.country,
-                vat_rate=product.vat_rate,
-                vat_category=product.vat_category,
-                shipping_vat_rate=product.shipping_vat_rate,
-            )
-            success_count += 1
+            valid_rows.append({
+                "product_type": product.product_type,
+                "country": product.country,
+                "vat_rate": product.vat_rate,
+                "vat_category": product.vat_category,
+                "shipping_vat_rate": product.shipping_vat_rate,
+            })
         except Exception as e:
             errors.append(f"Row {idx}: {str(e)}")
 
+    if valid_rows:
+        try:
+            success_count = await create_products(valid_rows)
+        except Exception as e:
+            errors.append(f"Import failed: {str(e)}")
+        invalidate_vat_table()
     return {
         "imported": success_count,
         "errors": errors
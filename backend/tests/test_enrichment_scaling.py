@@ -0,0 +1,40 @@
+import time
+import pandas as pd
+import pytest
+from app.core.validate_file import compute_vat_enrichment
+from app.core.vat_enrichment import build_vat_table
+from test_vat_enrichment import HEADER_LABELS, fx_index_from, make_orders, make_reference_data
+
+# Row counts timed, each 4x the previous one
+ROW_COUNTS = (10_000, 40_000, 160_000)
+# Allowed time ratio per 4x rows: linear is ~4 (less while fixed costs
+# dominate), a quadratic path would be ~16
+MAX_GROWTH = 8
+
+
+def best_time(df: pd.DataFrame, vat_table, fx_index, repeat: int = 3) -> float:
+    timings = []
+    for _ in range(repeat):
+        frame = df.copy()
+        started = time.perf_counter()
+        compute_vat_enrichment(frame, vat_table, fx_index, HEADER_LABELS)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+# Wall-clock benchmark; excluded by default, run with `pytest -m slow`
+@pytest.mark.slow
+def test_enrichment_time_grows_linearly_with_rows():
+    products, rates = make_reference_data()
+    vat_table, fx_index = build_vat_table(products), fx_index_from(rates)
+    # One base frame tiled up, so every size has the same value mix
+    base = make_orders(ROW_COUNTS[0], "found")
+
+    timings = []
+    for rows in ROW_COUNTS:
+        df = pd.concat([base] * (rows // len(base)), ignore_index=True)
+        timings.append(best_time(df, vat_table, fx_index))
+
+    ratios = [later / earlier for earlier, later in zip(timings, timings[1:])]
+    report = ", ".join(f"{rows} rows {seconds:.3f}s" for rows, seconds in zip(ROW_COUNTS, timings))
+    assert all(ratio < MAX_GROWTH for ratio in ratios), f"non-linear growth: {report}"
@@ -89,6 +89,13 @@ export interface TaxIssue {
     severity: "High" | "Medium" | "Low"
 }
 
+// One flagged row of a data issue; type issues only carry the row number
+export interface InvalidRow {
+    rowNumber: number
+    value?: string | null
+    issue?: string
+}
+
 // Enhanced issue type for better type safety
 export interface ValidationIssue {
     id: number
@@ -107,7 +114,7 @@ export interface ValidationIssue {
         dataType?: string
         headerLabel?: string
         missingRows?: string[]
-        invalidRows?: string[]
+        invalidRows?: InvalidRow[]
         hasMoreRows?: boolean
         totalMissing?: number
         totalRows?: number
@@ -35,6 +35,11 @@ import axios from "axios";
 import { useUploadStore } from "@/store/uploadStore";
 import { toast } from "sonner";
 
+// Rows flagged by an issue. Large issues only carry a preview of their rows,
+// so prefer the exact count from the backend.
+const countInvalidRows = (issue: ValidationIssue) =>
+  issue.details?.invalidCount ?? issue.details?.invalidRows?.length ?? 0;
+
 export default function CorrectionStep({
   onNext,
   onPrevious,
@@ -176,11 +181,12 @@ export default function CorrectionStep({
               headerLabel: dataIssue.header_label,
               dataType: dataIssue.data_type,
               missingRows: dataIssue.missing_rows,
-              invalidRows: dataIssue.invalid_rows?.map((row: any) => ({
-                rowNumber: row.row,
-                value: row.value,
-                issue: row.issue,
-              })),
+              // INVALID_TYPE sends plain row numbers, INVALID_QUARTER {row, value, issue}
+              invalidRows: dataIssue.invalid_rows?.map((row: any) =>
+                typeof row === "number"
+                  ? { rowNumber: row }
+                  : { rowNumber: row.row, value: row.value, issue: row.issue }
+              ),
               hasMoreRows: dataIssue.has_more_rows,
               totalMissing: dataIssue.total_missing,
               totalRows: dataIssue.total_rows,
@@ -371,6 +377,8 @@ export default function CorrectionStep({
     }
 
     const invalidRows = issue.details.invalidRows;
+    // Large issues only carry a preview of their rows; the count is exact
+    const invalidCount = issue.details.invalidCount ?? invalidRows.length;
     const isExpanded = expandedQuarterIssues.has(issue.id);
 
     return (
@@ -384,8 +392,8 @@ export default function CorrectionStep({
           ) : (
             <ChevronRight className="w-3 h-3" />
           )}
-          View {invalidRows.length} invalid date
-          {invalidRows.length > 1 ? "s" : ""}
+          View {invalidCount} invalid date
+          {invalidCount > 1 ? "s" : ""}
         </button>
 
         {isExpanded && (
@@ -401,9 +409,9 @@ export default function CorrectionStep({
                 </div>
               </div>
             ))}
-            {invalidRows.length > 5 && (
+            {invalidCount > 5 && (
               <div className="text-xs text-red-600 italic">
-                ...and {invalidRows.length - 5} more invalid dates
+                ...and {invalidCount - 5} more invalid dates
               </div>
             )}
           </div>
@@ -509,7 +517,7 @@ export default function CorrectionStep({
                 <div>
                   <div className="text-xl lg:text-2xl font-semibold text-red-600">
                     {issues.reduce((total, issue) => {
-                      return total + (issue.details?.invalidRows?.length || 0);
+                      return total + countInvalidRows(issue);
                     }, 0)}
                   </div>
                   <div className="text-sm text-gray-600">Total Issues</div>
@@ -622,8 +630,11 @@ export default function CorrectionStep({
                           issue.details.issueType === "INVALID_QUARTER" && (
                             <div className="mt-2">
                               <div className="font-medium text-sky-900 mb-1">
-                                {issue.details.invalidRows.length} Invalid Date
-                                {issue.details.invalidRows.length > 1
+                                {issue.details.invalidCount ??
+                                  issue.details.invalidRows.length}{" "}
+                                Invalid Date
+                                {(issue.details.invalidCount ??
+                                  issue.details.invalidRows.length) > 1
                                   ? "s"
                                   : ""}{" "}
                                 Found
@@ -643,7 +654,10 @@ export default function CorrectionStep({
                           issue.details.issueType !== "INVALID_QUARTER" && (
                             <div>
                               Invalid Rows:{" "}
-                              {issue.details.invalidRows.slice(0, 5).join(", ")}
+                              {issue.details.invalidRows
+                                .slice(0, 5)
+                                .map((row) => row.rowNumber)
+                                .join(", ")}
                               {issue.details.hasMoreRows ? "..." : ""}
                             </div>
                           )}
@@ -762,7 +776,9 @@ export default function CorrectionStep({
                                     Rows:{" "}
                                     {(
                                       issue.details.missingRows ||
-                                      issue.details.invalidRows
+                                      issue.details.invalidRows?.map(
+                                        (row) => row.rowNumber
+                                      )
                                     )
                                       ?.slice(0, 3)
                                       .join(", ")}
@@ -872,7 +888,7 @@ export default function CorrectionStep({
             {!allIssuesResolved && issues.length > 0 ? (
               <div
                 title={`Resolve ${issues.reduce((total, issue) => {
-                  return total + (issue.details?.invalidRows?.length || 0);
+                  return total + countInvalidRows(issue);
                 }, 0)} issues first`}
                 className="w-full sm:w-auto"
               >